@@ -0,0 +1,269 @@
+"""
+Benchmarks of the hot paths of password_rotate against SQLite.
+
+Usage::
+
+    python benchmarks/run.py --output results.json
+
+The results are written as JSON so that they can be compared between releases.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "password_rotate.tests.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.contrib.auth.hashers import get_hashers, make_password  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import CaptureQueriesContext, setup_test_environment  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from password_rotate.hashers import get_history_hasher, make_history_password  # noqa: E402
+from password_rotate.models import PasswordChange, PasswordHistory  # noqa: E402
+
+
+HISTORY_DEPTHS = [1, 3, 10, 24]
+HISTORY_HASHERS = [
+    "password_rotate.hashers.HistoryPBKDF2PasswordHasher",
+    "password_rotate.hashers.HistoryArgon2PasswordHasher",
+]
+
+
+def measure(func, repeat, setup=None):
+    """
+    Runs `func` `repeat` times and returns the timings (in ms) and the number of
+    queries of the last run (transaction statements included). `setup` is called
+    before each run, outside the timing.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "mean_ms": statistics.mean(timings),
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "max_ms": max(timings),
+        "queries": len(queries),
+        "repeat": repeat,
+    }
+
+
+def create_user(username, password="password"):
+    user = get_user_model()(username=username, email=f"{username}@example.org")
+    user.set_password(password)
+    user.save()
+    return user
+
+
+def set_last_changed(user, seconds_ago):
+    record = PasswordChange.objects.get(user=user)
+    record.last_changed = timezone.now() - timedelta(seconds=seconds_ago)
+    record.save()
+
+
+def bench_middleware(repeat):
+    """
+    Per-request latency and number of queries of the middleware for each kind of request.
+    The baseline is the same request without the middleware.
+    """
+    results = []
+    scenarios = {
+        "anonymous": (None, "/some_page/"),
+        "valid": (0, "/some_page/"),
+        "warning": (settings.PASSWORD_ROTATE_SECONDS - 60, "/some_page/"),
+        "expired": (settings.PASSWORD_ROTATE_SECONDS + 60, "/some_page/"),
+        "exempt": (settings.PASSWORD_ROTATE_SECONDS + 60, "/logout/"),
+    }
+    without_middleware = [
+        name for name in settings.MIDDLEWARE if name != "password_rotate.middleware.PasswordRotateMiddleware"
+    ]
+    for scenario, (seconds_ago, path) in scenarios.items():
+        logged_in = Client()
+        if seconds_ago is not None:
+            user = create_user(f"middleware_{scenario}")
+            logged_in.force_login(user)
+            set_last_changed(user, seconds_ago)
+        for middleware, label in [(settings.MIDDLEWARE, "middleware"), (without_middleware, "baseline")]:
+            with override_settings(MIDDLEWARE=middleware):
+                # The middleware chain is loaded by the first request of a client
+                client = Client()
+                client.cookies = logged_in.cookies
+                client.get(path)
+                result = measure(lambda: client.get(path), repeat)
+            results.append({"name": "middleware", "scenario": scenario, "variant": label, **result})
+    return results
+
+
+def get_available_hashers():
+    hashers = []
+    for hasher in get_hashers():
+        try:
+            hasher.encode("password", hasher.salt())
+        except ValueError:
+            # The library of the hasher isn't installed
+            continue
+        hashers.append(hasher)
+    return hashers
+
+
+def bench_check_password(repeat):
+    """
+    Cost of `PasswordHistoryManager.check_password` by hasher and history depth.
+    """
+    results = []
+    for hasher in get_available_hashers():
+        for depth in HISTORY_DEPTHS:
+            user = create_user(f"history_{hasher.algorithm}_{depth}")
+            PasswordHistory.objects.filter(user=user).delete()
+            user.password = make_password("password", hasher=hasher)
+            user.save()
+            PasswordHistory.objects.bulk_create([
+                PasswordHistory(user=user, password=make_password(f"password {i}", hasher=hasher))
+                for i in range(depth)
+            ])
+            result = measure(
+                lambda: PasswordHistory.objects.check_password(user, "new password", offset=depth), repeat
+            )
+            results.append({
+                "name": "check_password", "hasher": hasher.algorithm, "history_depth": depth, **result
+            })
+    return results
+
+
+def bench_history_hasher(repeat):
+    """
+    Cost of `PasswordHistoryManager.check_password` by history depth when the history
+    is stored with a `PASSWORD_ROTATE_HISTORY_HASHER` (the current password is still
+    verified with the login hasher).
+    """
+    results = []
+    for path in HISTORY_HASHERS:
+        with override_settings(PASSWORD_ROTATE_HISTORY_HASHER=path):
+            try:
+                make_history_password("password", None)
+            except ValueError:
+                # The library of the hasher isn't installed
+                continue
+            algorithm = get_history_hasher().algorithm
+            for depth in HISTORY_DEPTHS:
+                user = create_user(f"history_hasher_{algorithm}_{depth}")
+                PasswordHistory.objects.filter(user=user).delete()
+                PasswordHistory.objects.bulk_create([
+                    PasswordHistory(user=user, password=make_history_password(f"password {i}", None))
+                    for i in range(depth)
+                ])
+                result = measure(
+                    lambda: PasswordHistory.objects.check_password(user, "new password", offset=depth), repeat
+                )
+                results.append({
+                    "name": "history_hasher", "hasher": algorithm, "history_depth": depth, **result
+                })
+    return results
+
+
+def bench_signals(repeat):
+    """
+    Cost of the signal handlers when a user is created and when a password changes.
+    The passwords are hashed outside of the timings.
+    """
+    results = []
+    users = []
+
+    def setup_create():
+        user = get_user_model()(username=f"signals_create_{len(users)}")
+        user.set_password("password")
+        users.append(user)
+
+    results.append({
+        "name": "create_user_handler", **measure(lambda: users[-1].save(), repeat, setup=setup_create)
+    })
+
+    user = create_user("signals_change")
+
+    def setup_change():
+        user._has_not_previous_password = True
+        user.set_password("password")
+
+    results.append({"name": "change_password_handler", **measure(user.save, repeat, setup=setup_change)})
+    return results
+
+
+def bench_delete_expired(repeat):
+    """
+    Cost of `PasswordHistoryManager.delete_expired` when the history is full.
+    """
+    user = create_user("delete_expired")
+
+    def setup():
+        PasswordHistory.objects.bulk_create([
+            PasswordHistory(user=user, password=user.password) for _ in range(settings.PASSWORD_ROTATE_HISTORY_COUNT)
+        ])
+
+    return [{
+        "name": "delete_expired", **measure(lambda: PasswordHistory.objects.delete_expired(user), repeat, setup=setup)
+    }]
+
+
+BENCHMARKS = {
+    "middleware": bench_middleware,
+    "check_password": bench_check_password,
+    "history_hasher": bench_history_hasher,
+    "signals": bench_signals,
+    "delete_expired": bench_delete_expired,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="The JSON file of the results (default: stdout).")
+    parser.add_argument("--repeat", type=int, default=20, help="The number of runs of each benchmark.")
+    parser.add_argument(
+        "--only", action="append", choices=sorted(BENCHMARKS), help="Only run this benchmark. Can be repeated."
+    )
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        results = []
+        for name in args.only or BENCHMARKS:
+            results += BENCHMARKS[name](args.repeat)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "sqlite": connection.Database.sqlite_version,
+            "date": timezone.now().isoformat(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,97 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Case, CharField, Value, When
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
 from password_rotate.models import PasswordChange, PasswordHistory
 
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the estimate of the query planner as the number of rows of large
+    unfiltered tables on PostgreSQL instead of counting them.
+    """
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql" and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE relname = %s", [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] > self.estimate_threshold:
+                return int(row[0])
+        return super().count
+
+
+class PasswordStatusFilter(admin.SimpleListFilter):
+    title = _("password status")
+    parameter_name = "status"
+
+    def lookups(self, request, model_admin):
+        return (
+            ("valid", _("Valid")),
+            ("warning", _("Warning")),
+            ("expired", _("Expired")),
+        )
+
+    def queryset(self, request, queryset):
+        now = timezone.now()
+        if self.value() == "valid":
+            return queryset.filter(warn_at__gte=now)
+        if self.value() == "warning":
+            return queryset.in_warning_window(now)
+        if self.value() == "expired":
+            return queryset.expired(now)
+        return queryset
+
+
 @admin.register(PasswordChange)
 class PasswordChangeAdmin(admin.ModelAdmin):
     model = PasswordChange
-    list_display = ("user", "last_changed")
+    list_display = ("user", "last_changed", "expires_at", "policy", "password_status")
+    list_filter = (PasswordStatusFilter, "policy")
+    list_select_related = ("user",)
+    raw_id_fields = ("user",)
+    search_fields = ("user__username",)
+    date_hierarchy = "last_changed"
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        now = timezone.now()
+        return super().get_queryset(request).annotate(
+            password_status=Case(
+                When(expires_at__lt=now, then=Value("expired")),
+                When(warn_at__lt=now, then=Value("warning")),
+                default=Value("valid"),
+                output_field=CharField(),
+            )
+        )
+
+    @admin.display(description=_("password status"), ordering="expires_at")
+    def password_status(self, obj):
+        return obj.password_status
 
 
 @admin.register(PasswordHistory)
-class PasswordHistory(admin.ModelAdmin):
+class PasswordHistoryAdmin(admin.ModelAdmin):
     model = PasswordHistory
     list_display = ("user", "created")
+    list_select_related = ("user",)
+    raw_id_fields = ("user",)
+    search_fields = ("user__username",)
+    date_hierarchy = "created"
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # The encrypted passwords are never listed
+        return super().get_queryset(request).defer("password", "digest")
@@ -6,5 +6,6 @@ class PasswordRotateConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
 
     def ready(self):
-        from . import signals
+        from . import policy, signals
+        policy.build_policy()
         signals.register_signals()
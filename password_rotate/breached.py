@@ -0,0 +1,107 @@
+import hashlib
+import mmap
+import os
+import struct
+
+
+RECORD_SIZE = 20  # length of a SHA-1 digest
+MAGIC = b"PRBRCH1\n"
+INDEX_ENTRIES = 0x10000 + 1
+INDEX_FORMAT = f"<{INDEX_ENTRIES}Q"
+HEADER_SIZE = len(MAGIC) + struct.calcsize(INDEX_FORMAT)
+
+
+class BreachedPasswordFile:
+    """
+    Looks up the SHA-1 digests of the passwords in a file of sorted 20 bytes records.
+
+    The file is memory-mapped so only the pages visited by the binary search are
+    read. When it starts with an index (built by `write_breached_password_file`),
+    the offsets of the first records of each 2 bytes prefix narrow the search.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            # an empty file can't be memory-mapped
+            if os.fstat(f.fileno()).st_size:
+                self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.mmap = b""
+        if self.mmap[:len(MAGIC)] == MAGIC:
+            self.index = struct.unpack_from(INDEX_FORMAT, self.mmap, len(MAGIC))
+            self.start = HEADER_SIZE
+        else:
+            self.index = None
+            self.start = 0
+        size = len(self.mmap) - self.start
+        if size % RECORD_SIZE:
+            raise ValueError(f"{path} is not a file of SHA-1 digests.")
+        self.count = size // RECORD_SIZE
+
+    def __len__(self):
+        return self.count
+
+    def get_record(self, position):
+        offset = self.start + position * RECORD_SIZE
+        return self.mmap[offset:offset + RECORD_SIZE]
+
+    def contains_digest(self, digest):
+        if self.index is None:
+            low, high = 0, self.count
+        else:
+            prefix = int.from_bytes(digest[:2], "big")
+            low, high = self.index[prefix], self.index[prefix + 1]
+        while low < high:
+            middle = (low + high) // 2
+            record = self.get_record(middle)
+            if record < digest:
+                low = middle + 1
+            elif record > digest:
+                high = middle
+            else:
+                return True
+        return False
+
+    def __contains__(self, password):
+        return self.contains_digest(hashlib.sha1(password.encode()).digest())
+
+
+def write_breached_password_file(lines, output, index=True):
+    """
+    Writes the sorted hexadecimal SHA-1 digests of `lines` (in the "HASH:COUNT"
+    format of the Have I Been Pwned dumps, ordered by hash) to the binary file
+    `output`. The lines are processed one by one.
+
+    Returns the number of written records. Raises ValueError when a line is not
+    a digest or when the lines are not sorted.
+    """
+    counts = [0] * (INDEX_ENTRIES - 1)
+    previous = None
+    written = 0
+    if index:
+        output.write(bytes(HEADER_SIZE))
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            digest = bytes.fromhex(line.split(":", 1)[0])
+        except ValueError:
+            digest = b""
+        if len(digest) != RECORD_SIZE:
+            raise ValueError(f"Line {number} is not a SHA-1 digest.")
+        if previous is not None and digest <= previous:
+            if digest == previous:
+                continue
+            raise ValueError(f"Line {number} is not sorted, the lines must be ordered by hash.")
+        output.write(digest)
+        counts[int.from_bytes(digest[:2], "big")] += 1
+        previous = digest
+        written += 1
+    if index:
+        offsets = [0]
+        for count in counts:
+            offsets.append(offsets[-1] + count)
+        output.seek(0)
+        output.write(MAGIC + struct.pack(INDEX_FORMAT, *offsets))
+    return written
@@ -0,0 +1,115 @@
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from .policy import get_policies
+
+
+def get_cache():
+    """
+    Returns the cache backend configured by `PASSWORD_ROTATE_CACHE` or None when
+    the lookups of `PasswordChange` are not cached.
+    """
+    alias = getattr(settings, "PASSWORD_ROTATE_CACHE", None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def get_shared_cache():
+    """
+    Returns the cache of `PASSWORD_ROTATE_CACHE`, or the default cache. It must be
+    shared by all the web nodes.
+    """
+    return caches[getattr(settings, "PASSWORD_ROTATE_CACHE", None) or DEFAULT_CACHE_ALIAS]
+
+
+def get_policy_version_key(user_id):
+    return f"password_rotate:policy_version:{user_id}"
+
+
+def get_policy_version(user_id):
+    """
+    Returns the version of the policy stored for the user, which changes when
+    their groups change, or None when there is only the default policy.
+    """
+    if len(get_policies()) == 1:
+        return None
+    return get_shared_cache().get(get_policy_version_key(user_id))
+
+
+async def aget_policy_version(user_id):
+    if len(get_policies()) == 1:
+        return None
+    return await get_shared_cache().aget(get_policy_version_key(user_id))
+
+
+def bump_policy_version(user_id):
+    get_shared_cache().set(get_policy_version_key(user_id), time.time_ns(), None)
+
+
+def get_cache_key(user_id):
+    return f"password_rotate:password_change:{user_id}"
+
+
+def get_password_change(user_id):
+    """
+    Returns the `(last_changed, policy)` of the user or None.
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    return cache.get(get_cache_key(user_id))
+
+
+async def aget_password_change(user_id):
+    cache = get_cache()
+    if cache is None:
+        return None
+    return await cache.aget(get_cache_key(user_id))
+
+
+def set_password_change(user_id, last_changed, policy=None):
+    cache = get_cache()
+    if cache is not None:
+        timeout = getattr(settings, "PASSWORD_ROTATE_CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+        cache.set(get_cache_key(user_id), (last_changed, policy), timeout)
+
+
+def add_password_change(user_id, last_changed, policy=None):
+    """
+    Same as `set_password_change` but keeps the value set by the signal handlers
+    when a lookup (maybe on a lagging replica) returns after them.
+    """
+    cache = get_cache()
+    if cache is not None:
+        timeout = getattr(settings, "PASSWORD_ROTATE_CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+        cache.add(get_cache_key(user_id), (last_changed, policy), timeout)
+
+
+async def aadd_password_change(user_id, last_changed, policy=None):
+    cache = get_cache()
+    if cache is not None:
+        timeout = getattr(settings, "PASSWORD_ROTATE_CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+        await cache.aadd(get_cache_key(user_id), (last_changed, policy), timeout)
+
+
+def set_many_password_changes(password_changes):
+    """
+    :arg password_changes: The `(last_changed, policy)` by user id.
+    """
+    cache = get_cache()
+    if cache is not None:
+        timeout = getattr(settings, "PASSWORD_ROTATE_CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+        cache.set_many(
+            {get_cache_key(user_id): value for user_id, value in password_changes.items()},
+            timeout,
+        )
+
+
+def delete_password_change(user_id):
+    cache = get_cache()
+    if cache is not None:
+        cache.delete(get_cache_key(user_id))
@@ -0,0 +1,85 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.urls import NoReverseMatch, get_script_prefix, get_urlconf, reverse
+
+
+DEFAULT_EXEMPT_URLS = ["logout", "admin:logout"]
+
+
+class UrlExemptions:
+    """
+    Matches the paths of the pages where the password is not checked.
+
+    An exemption is either a URL name (ex: "logout"), a path prefix starting
+    with "/" (ex: "/api/") or a regular expression matched against the
+    beginning of the path (ex: `re.compile(r"/health/?$")`).
+
+    The URL names are reversed once per urlconf and script prefix.
+    """
+    def __init__(self, exempt_urls):
+        self.url_names = []
+        prefixes = []
+        self.patterns = []
+        for url in exempt_urls:
+            if isinstance(url, re.Pattern):
+                self.patterns.append(url)
+            elif url.startswith("/"):
+                prefixes.append(url)
+            else:
+                self.url_names.append(url)
+        self.prefixes = tuple(prefixes)
+        self._paths = {}
+        self._exempt_paths = {}
+
+    def reverse(self, url_name):
+        """
+        Memoized `reverse` for URL names without arguments.
+        """
+        # `reverse` adds the script prefix of the current thread
+        key = (get_urlconf(), get_script_prefix(), url_name)
+        try:
+            return self._paths[key]
+        except KeyError:
+            path = self._paths[key] = reverse(url_name, urlconf=key[0])
+            return path
+
+    def get_exempt_paths(self):
+        key = (get_urlconf(), get_script_prefix())
+        try:
+            return self._exempt_paths[key]
+        except KeyError:
+            pass
+        paths = set()
+        for url_name in self.url_names:
+            try:
+                paths.add(self.reverse(url_name))
+            except NoReverseMatch:
+                # The URL isn't part of this urlconf
+                pass
+        paths = self._exempt_paths[key] = frozenset(paths)
+        return paths
+
+    def is_exempt(self, path):
+        if path in self.get_exempt_paths() or path.startswith(self.prefixes):
+            return True
+        return any(pattern.match(path) for pattern in self.patterns)
+
+
+@lru_cache(maxsize=None)
+def get_url_exemptions():
+    exempt_urls = list(getattr(settings, "PASSWORD_ROTATE_EXEMPT_URLS", DEFAULT_EXEMPT_URLS))
+    # Static and media files never need a warning
+    for url in (settings.STATIC_URL, settings.MEDIA_URL):
+        if url and url.startswith("/") and url != "/":
+            exempt_urls.append(url)
+    return UrlExemptions(exempt_urls)
+
+
+@receiver(setting_changed)
+def reset_url_exemptions(*, setting, **kwargs):
+    if setting in ("PASSWORD_ROTATE_EXEMPT_URLS", "ROOT_URLCONF", "STATIC_URL", "MEDIA_URL"):
+        get_url_exemptions.cache_clear()
@@ -0,0 +1,68 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, PBKDF2PasswordHasher, check_password
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class HistoryPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 with fewer iterations than the login hasher: all the entries of the
+    history are verified when the password changes.
+    """
+    algorithm = "history_pbkdf2_sha256"
+    iterations = 100_000
+
+
+class HistoryArgon2PasswordHasher(Argon2PasswordHasher):
+    """
+    Argon2 with the minimum parameters recommended by OWASP (19 MiB, 2 iterations,
+    1 thread) instead of those of the login hasher.
+    """
+    algorithm = "history_argon2"
+    time_cost = 2
+    memory_cost = 19 * 1024
+    parallelism = 1
+
+
+@lru_cache(maxsize=None)
+def get_history_hasher():
+    """
+    Returns the hasher set in `PASSWORD_ROTATE_HISTORY_HASHER` or None when the
+    history stores the hashes of the login hasher.
+    """
+    path = getattr(settings, "PASSWORD_ROTATE_HISTORY_HASHER", None)
+    if not path:
+        return None
+    return import_string(path)()
+
+
+@receiver(setting_changed)
+def reset_history_hasher(*, setting, **kwargs):
+    if setting == "PASSWORD_ROTATE_HISTORY_HASHER":
+        get_history_hasher.cache_clear()
+
+
+def make_history_password(raw_password, encoded_password):
+    """
+    Returns the password stored in `PasswordHistory`: the raw password hashed by the
+    history hasher, or the encoded password of the user when there is no history
+    hasher or when the raw password is unknown.
+    """
+    hasher = get_history_hasher()
+    if hasher is None or raw_password is None:
+        return encoded_password
+    return hasher.encode(raw_password, hasher.salt())
+
+
+def check_history_password(raw_password, encoded_password):
+    """
+    Same as `django.contrib.auth.hashers.check_password` but the history hasher
+    doesn't need to be listed in `PASSWORD_HASHERS`.
+    """
+    hasher = get_history_hasher()
+    if hasher is not None and encoded_password and encoded_password.startswith(f"{hasher.algorithm}$"):
+        return hasher.verify(raw_password, encoded_password)
+    return check_password(raw_password, encoded_password)
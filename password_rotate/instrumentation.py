@@ -0,0 +1,142 @@
+import bisect
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class BaseCollector:
+    """
+    Receives the timing and the outcome of the operations of password_rotate.
+
+    Set the dotted path of a subclass in `PASSWORD_ROTATE_INSTRUMENTATION` to
+    feed them into a metrics pipeline.
+
+    The events are:
+
+    * "middleware": the password check of a request ("exempt", "anonymous", "redirect", "warning",
+      "warning_throttled" or "valid")
+    * "checker": the lookup of the last password change ("cache", "database" or "date_joined")
+    * "history_verification": the verification of one hash ("match" or "no_match")
+    * "create_user_handler", "change_password_handler", "login_handler": the signal handlers
+    """
+    def record(self, event, duration, outcome=None):
+        """
+        :arg str event: The name of the operation.
+        :arg float duration: Its duration in seconds.
+        :arg str outcome: Its outcome ("error" if it raised an exception).
+        """
+        raise NotImplementedError
+
+
+class Histogram:
+    """
+    A histogram of durations with cumulative buckets.
+    """
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+    def __init__(self):
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        total = 0
+        result = {}
+        for bucket, count in zip(self.buckets, self.counts):
+            total += count
+            result[bucket] = total
+        return result
+
+
+class InMemoryCollector(BaseCollector):
+    """
+    Keeps counters by `(event, outcome)` and a histogram of durations by event.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def record(self, event, duration, outcome=None):
+        with self.lock:
+            self.counters[(event, outcome)] += 1
+            if event not in self.histograms:
+                self.histograms[event] = Histogram()
+            self.histograms[event].observe(duration)
+
+    def reset(self):
+        with self.lock:
+            self.counters = Counter()
+            self.histograms = {}
+
+
+@lru_cache(maxsize=None)
+def get_collector():
+    """
+    Returns the collector set in `PASSWORD_ROTATE_INSTRUMENTATION` or None.
+    """
+    path = getattr(settings, "PASSWORD_ROTATE_INSTRUMENTATION", None)
+    if not path:
+        return None
+    return import_string(path)()
+
+
+@receiver(setting_changed)
+def reset_collector(*, setting, **kwargs):
+    if setting == "PASSWORD_ROTATE_INSTRUMENTATION":
+        get_collector.cache_clear()
+
+
+class Measure:
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = None
+
+
+@contextmanager
+def instrument(event):
+    """
+    Records the duration of the block. The outcome can be set on the yielded object::
+
+        with instrument("checker") as measure:
+            measure.outcome = "cache"
+    """
+    measure = Measure()
+    collector = get_collector()
+    if collector is None:
+        yield measure
+        return
+
+    start = time.perf_counter()
+    try:
+        yield measure
+    except BaseException:
+        measure.outcome = "error"
+        raise
+    finally:
+        collector.record(event, time.perf_counter() - start, measure.outcome)
+
+
+def instrumented(event):
+    """
+    Decorator recording the duration of each call of the function.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with instrument(event):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
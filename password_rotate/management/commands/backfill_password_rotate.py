@@ -0,0 +1,37 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+
+from password_rotate.models import PasswordChange
+from password_rotate.utils import provision_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates the missing `PasswordChange` and `PasswordHistory` rows of users created "
+        "without signals. The date the users joined is used as the date of their last password change."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="The number of users processed at once (default: 1000).",
+        )
+
+    def handle(self, *args, **options):
+        users = (
+            get_user_model().objects
+            .filter(~Exists(PasswordChange.objects.filter(user=OuterRef("pk"))))
+            .order_by("pk")
+        )
+        total = 0
+        last_pk = None
+        while True:
+            chunk = users if last_pk is None else users.filter(pk__gt=last_pk)
+            chunk = list(chunk[:options["batch_size"]])
+            if not chunk:
+                break
+            provision_users(chunk, batch_size=options["batch_size"], use_date_joined=True)
+            total += len(chunk)
+            last_pk = chunk[-1].pk
+        self.stdout.write(f"Provisioned {total} users.")
@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from password_rotate.breached import write_breached_password_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the file of the `BreachedPasswordValidator` from a dump of SHA-1 hashes "
+        "(one \"HASH:COUNT\" line per password, ordered by hash, as downloaded from Have I Been Pwned). "
+        "The dump is read line by line."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="The text dump, or - to read the standard input.")
+        parser.add_argument("output", help="The binary file to write.")
+        parser.add_argument(
+            "--no-index", action="store_false", dest="index",
+            help="Don't write the index of the hash prefixes (512 KB) at the beginning of the file.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["output"], "wb") as output:
+                if options["input"] == "-":
+                    count = write_breached_password_file(sys.stdin, output, options["index"])
+                else:
+                    with open(options["input"], encoding="ascii") as lines:
+                        count = write_breached_password_file(lines, output, options["index"])
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+        self.stdout.write(f"Wrote {count} hashes to {options['output']}.")
@@ -0,0 +1,50 @@
+import csv
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from password_rotate.utils import annotate_password_status
+
+
+STATUSES = ["valid", "warning", "expired", "excluded"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports the status of the users' passwords (valid, warning, expired or excluded). "
+        "The statuses are computed by the database and streamed to stdout."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--status", action="append", choices=STATUSES,
+            help="Only report the users with this status. Can be repeated.",
+        )
+        parser.add_argument(
+            "--format", choices=["csv", "jsonl"], default="csv",
+            help="The output format: CSV or JSON lines (default: csv).",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=2000,
+            help="The number of users fetched from the database at once (default: 2000).",
+        )
+
+    def handle(self, *args, **options):
+        user_model = get_user_model()
+        fields = ["pk", user_model.USERNAME_FIELD, "password_last_changed", "password_status"]
+        users = annotate_password_status(user_model.objects.order_by("pk"))
+        if options["status"]:
+            users = users.filter(password_status__in=options["status"])
+        rows = users.values_list(*fields).iterator(chunk_size=options["chunk_size"])
+
+        header = ["id", "username", "last_changed", "status"]
+        if options["format"] == "csv":
+            writer = csv.writer(self.stdout, lineterminator="\n")
+            writer.writerow(header)
+            for pk, username, last_changed, status in rows:
+                writer.writerow([pk, username, last_changed.isoformat(), status])
+        else:
+            for pk, username, last_changed, status in rows:
+                row = dict(zip(header, [pk, username, last_changed.isoformat(), status]))
+                self.stdout.write(json.dumps(row))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+
+from password_rotate.models import PasswordHistory
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports how many password history entries have no digest. These legacy entries "
+        "are verified with the password hasher instead of `PASSWORD_ROTATE_HISTORY_PEPPER`."
+    )
+
+    def handle(self, *args, **options):
+        counts = PasswordHistory.objects.aggregate(
+            total=Count("pk"),
+            legacy=Count("pk", filter=Q(digest__isnull=True)),
+            users=Count("user", filter=Q(digest__isnull=True), distinct=True),
+        )
+        self.stdout.write(
+            f"{counts['legacy']} of {counts['total']} password history entries have no digest "
+            f"({counts['users']} users)."
+        )
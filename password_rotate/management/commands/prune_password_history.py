@@ -0,0 +1,37 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from password_rotate.models import PasswordHistory
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes the password history entries beyond the latest `PASSWORD_ROTATE_HISTORY_COUNT` "
+        "entries of each user. The users are processed in chunks ordered by primary key."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="The number of users processed by each statement (default: 1000).",
+        )
+        parser.add_argument(
+            "--history-count", type=int,
+            help="The number of entries to keep per user (default: PASSWORD_ROTATE_HISTORY_COUNT).",
+        )
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by("pk").values_list("pk", flat=True)
+        total = 0
+        last_pk = None
+        while True:
+            chunk = users if last_pk is None else users.filter(pk__gt=last_pk)
+            user_ids = list(chunk[:options["batch_size"]])
+            if not user_ids:
+                break
+            deleted = PasswordHistory.objects.delete_expired_for_users(user_ids, options["history_count"])
+            total += deleted
+            last_pk = user_ids[-1]
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Deleted {deleted} entries of the users up to {last_pk}.")
+        self.stdout.write(f"Deleted {total} password history entries.")
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from password_rotate.models import PasswordChange
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the expiration and warning dates of the passwords after a change "
+        "of `PASSWORD_ROTATE_SECONDS` or `PASSWORD_ROTATE_WARN_SECONDS`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=10000,
+            help="The number of rows updated by each statement (default: 10000).",
+        )
+
+    def handle(self, *args, **options):
+        records = PasswordChange.objects.order_by("pk").values_list("pk", flat=True)
+        total = 0
+        last_pk = None
+        while True:
+            chunk = records if last_pk is None else records.filter(pk__gt=last_pk)
+            pks = list(chunk[:options["batch_size"]])
+            if not pks:
+                break
+            total += PasswordChange.objects.filter(pk__gte=pks[0], pk__lte=pks[-1]).recompute_expiry()
+            last_pk = pks[-1]
+        self.stdout.write(f"Recomputed the expiration of {total} passwords.")
@@ -0,0 +1,95 @@
+import humanize
+from django.contrib.auth import get_user_model
+from django.core.mail import get_connection, send_mass_mail
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from password_rotate.models import NotificationCheckpoint, PasswordChange
+from password_rotate.policy import get_policies, get_policy
+
+
+class Command(BaseCommand):
+    help = (
+        "Emails the users whose password entered the warning window (`PASSWORD_ROTATE_WARN_SECONDS`) "
+        "since the last run. The first run notifies all the users in the warning window. "
+        "The checkpoint advances after each batch, so a failed run resumes after the notified users."
+    )
+    checkpoint_name = "expiry_warning"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="The number of emails sent by each batch (default: 500).",
+        )
+        parser.add_argument(
+            "--url", default="",
+            help="The absolute URL of the password change page, added to the emails.",
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        checkpoint = NotificationCheckpoint.objects.filter(name=self.checkpoint_name).first()
+        if checkpoint is None:
+            checkpoint = NotificationCheckpoint(name=self.checkpoint_name)
+            since = now - max(policy.warning_duration for policy in get_policies())
+        else:
+            since = checkpoint.last_run
+
+        records = self.get_records(since, now)
+        email_field = get_user_model().get_email_field_name()
+        total = 0
+        # Resumes a failed run after the last notified user
+        last = (since, checkpoint.last_pk) if checkpoint.last_pk is not None else None
+        with get_connection() as connection:
+            while True:
+                chunk = records if last is None else records.filter(
+                    Q(warn_at__gt=last[0]) | Q(warn_at=last[0], pk__gt=last[1])
+                )
+                batch = list(chunk[:options["batch_size"]])
+                if not batch:
+                    break
+                datatuple = [
+                    self.get_email(record, getattr(record.user, email_field), now, options["url"])
+                    for record in batch
+                    if getattr(record.user, email_field)
+                ]
+                total += send_mass_mail(datatuple, connection=connection)
+                last = (batch[-1].warn_at, batch[-1].pk)
+                checkpoint.last_run, checkpoint.last_pk = last
+                checkpoint.save()
+                if options["verbosity"] > 1:
+                    self.stdout.write(f"Sent {len(datatuple)} emails to the users up to {batch[-1].pk}.")
+
+        checkpoint.last_run = now
+        checkpoint.last_pk = None
+        checkpoint.save()
+        self.stdout.write(f"Sent {total} password expiry notifications.")
+
+    def get_records(self, since, now):
+        """
+        Returns the `PasswordChange` of the active users whose password entered the
+        warning window between `since` and `now` and didn't expire yet.
+        """
+        records = (
+            PasswordChange.objects
+            .filter(warn_at__gte=since, warn_at__lt=now, expires_at__gte=now, user__is_active=True)
+            .select_related("user")
+            .order_by("warn_at", "pk")
+        )
+        if get_policy().exclude_superusers:
+            records = records.exclude(user__is_superuser=True)
+        return records
+
+    def get_email(self, record, email, now, url):
+        """
+        Returns the `(subject, message, from_email, recipient_list)` of a notification.
+        """
+        message = (
+            f"Hello {record.user.get_username()},\n\n"
+            f"Your password expires in {humanize.naturaldelta(record.expires_at - now)}. "
+            "Please change it."
+        )
+        if url:
+            message += f"\n\n{url}"
+        return ("Your password expires soon", message, None, [email])
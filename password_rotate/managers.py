@@ -1,10 +1,229 @@
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+
 from django.db import models
-from django.contrib.auth.hashers import identify_hasher
+from django.db.models import Case, F, Value, When, Window
+from django.db.models.functions import RowNumber
 from django.conf import settings
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+
+from password_rotate.hashers import check_history_password
+from password_rotate.instrumentation import instrument
+from password_rotate.policy import get_policies, get_policy, get_user_policy
+from password_rotate.routing import get_read_database
+
+
+logger = logging.getLogger("password_rotate")
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns the thread pool used to verify the password history, or None when
+    the hashes are verified serially.
+
+    The size of the pool is set by `PASSWORD_ROTATE_HISTORY_WORKERS`.
+    """
+    workers = getattr(settings, "PASSWORD_ROTATE_HISTORY_WORKERS", min(4, os.cpu_count() or 1))
+    if workers <= 1:
+        return None
+    with _executors_lock:
+        if workers not in _executors:
+            _executors[workers] = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="password_rotate"
+            )
+        return _executors[workers]
+
+
+def verify_password(raw_password, encoded_password):
+    with instrument("history_verification") as measure:
+        matched = check_history_password(raw_password, encoded_password)
+        measure.outcome = "match" if matched else "no_match"
+    return matched
+
+
+def verify_any(raw_password, encoded_passwords):
+    """
+    Returns True if the raw password matches one of the encoded passwords.
+    """
+    return verify_many([(raw_password, encoded_passwords)])[0]
+
+
+def verify_many(candidates):
+    """
+    For each `(raw_password, encoded_passwords)` candidate, returns True if the raw
+    password matches one of the encoded passwords.
+
+    Identical encoded passwords are verified only once per candidate. The
+    verifications run on a thread pool (the hashers release the GIL) and stop at
+    the first match of each candidate.
+
+    When they exceed `PASSWORD_ROTATE_HISTORY_VERIFY_BUDGET` (in seconds), the
+    remaining hashes are considered as not matching and a warning is logged.
+    """
+    candidates = [(raw_password, list(dict.fromkeys(encoded))) for raw_password, encoded in candidates]
+    budget = getattr(settings, "PASSWORD_ROTATE_HISTORY_VERIFY_BUDGET", None)
+    deadline = None if budget is None else time.monotonic() + budget
+    results = [False] * len(candidates)
+    executor = get_executor()
+    if executor is None or sum(len(encoded) for _, encoded in candidates) <= 1:
+        for index, (raw_password, encoded) in enumerate(candidates):
+            for password in encoded:
+                if deadline is not None and time.monotonic() >= deadline:
+                    log_budget_exceeded(budget)
+                    return results
+                if verify_password(raw_password, password):
+                    results[index] = True
+                    break
+        return results
+
+    outstanding = [len(encoded) for _, encoded in candidates]
+    undecided = sum(1 for count in outstanding if count)
+    futures = {}
+    for index, (raw_password, encoded) in enumerate(candidates):
+        for password in encoded:
+            futures[executor.submit(verify_password, raw_password, password)] = index
+    try:
+        for future in as_completed(futures, timeout=budget):
+            index = futures[future]
+            if results[index] or future.cancelled():
+                continue
+            outstanding[index] -= 1
+            if future.result():
+                results[index] = True
+                # Drops the other verifications of this candidate
+                for other, other_index in futures.items():
+                    if other_index == index:
+                        other.cancel()
+            if results[index] or not outstanding[index]:
+                undecided -= 1
+                if not undecided:
+                    break
+    except TimeoutError:
+        log_budget_exceeded(budget)
+    finally:
+        # Drops the verifications that didn't start yet
+        for future in futures:
+            future.cancel()
+    return results
+
+
+def log_budget_exceeded(budget):
+    logger.warning(
+        "The verification of the password history exceeded PASSWORD_ROTATE_HISTORY_VERIFY_BUDGET "
+        "(%ss): the remaining hashes were not verified.", budget,
+    )
+
+
+def get_passwords_to_verify(user, digest, entries):
+    """
+    Returns the encoded passwords to verify for a user, or None when the digest
+    of the raw password matches one of the entries.
+
+    :arg user: A :class:`~django.contrib.auth.models.User` instance.
+    :arg str digest: The digest of the raw password or None.
+    :arg entries: The `(password, digest)` of the user's password history entries.
+    """
+    encoded_passwords = []
+    current_password_covered = False
+    for password, entry_digest in entries:
+        if digest is None or entry_digest is None:
+            encoded_passwords.append(password)
+        elif entry_digest == digest:
+            return None
+        elif password == user.password:
+            current_password_covered = True
+    if not current_password_covered:
+        # The latest entry is usually the current password: it is verified only once
+        encoded_passwords.insert(0, user.password)
+    return encoded_passwords
+
+
+def get_password_digest(raw_password):
+    """
+    Returns the HMAC of the raw password keyed with `PASSWORD_ROTATE_HISTORY_PEPPER`,
+    or None when no pepper is set.
+    """
+    pepper = getattr(settings, "PASSWORD_ROTATE_HISTORY_PEPPER", None)
+    if not pepper or raw_password is None:
+        return None
+    return hmac.new(force_bytes(pepper), force_bytes(raw_password), hashlib.sha256).hexdigest()
+
+
+class PasswordChangeQuerySet(models.QuerySet):
+    """
+    Filters on the indexed `expires_at` and `warn_at` columns.
+
+    The superusers excluded by `PASSWORD_ROTATE_EXCLUDE_SUPERUSERS` are not filtered out.
+    """
+    def expired(self, now=None):
+        return self.filter(expires_at__lt=now or timezone.now())
+
+    def in_warning_window(self, now=None):
+        now = now or timezone.now()
+        return self.filter(warn_at__lt=now, expires_at__gte=now)
+
+    def expiring_between(self, start, end):
+        return self.filter(expires_at__gte=start, expires_at__lt=end)
+
+    def recompute_expiry(self):
+        """
+        Recomputes `expires_at` and `warn_at` from the policy of each row, with
+        an UPDATE per policy.
+        """
+        named = [policy.name for policy in get_policies() if policy.name is not None]
+        updated = 0
+        for policy in get_policies():
+            if policy.name is None:
+                # The rows of the default policy or of a policy removed from the settings
+                records = self.exclude(policy__in=named)
+            else:
+                records = self.filter(policy=policy.name)
+            updated += records.update(**get_expiry_updates(policy))
+        return updated
+
+    def set_policy(self, policy):
+        """
+        Assigns the policy to the rows and recomputes their expiration with a single UPDATE.
+        """
+        return self.update(policy=policy.name, **get_expiry_updates(policy))
+
+
+def get_expiry_updates(policy):
+    return {
+        "expires_at": F("last_changed") + policy.allowed_duration,
+        "warn_at": F("last_changed") + (policy.allowed_duration - policy.warning_duration),
+    }
+
+
+def get_history_count_expression():
+    """
+    Returns the number of history entries to keep for the user of each entry,
+    following the policy stored with their `PasswordChange`.
+    """
+    default = get_policy()
+    whens = [
+        When(user__passwordchange__policy=policy.name, then=Value(policy.history_count))
+        for policy in get_policies() if policy.name is not None
+    ]
+    if not whens:
+        return Value(default.history_count)
+    return Case(*whens, default=Value(default.history_count), output_field=models.IntegerField())
 
 
 class PasswordHistoryManager(models.Manager):
-    default_offset = settings.PASSWORD_ROTATE_HISTORY_COUNT
+    @property
+    def default_offset(self):
+        return get_policy().history_count
 
     def delete_expired(self, user, offset=None):
         """
@@ -12,34 +231,109 @@ class PasswordHistoryManager(models.Manager):
 
         :arg user: A :class:`~django.contrib.auth.models.User` instance.
         :arg int offset: A number specifying how much entries are to be kept
-              in the user's password history. Defaults
-              to :py:attr:`~settings.PASSWORD_ROTATE_HISTORY_COUNT`.
+              in the user's password history. Defaults to the history count
+              of the user's policy.
+        :returns: The number of deleted entries.
+        :rtype: int
         """
-        if not offset:
-            offset = self.default_offset
-        qs = self.filter(user=user)
-        if qs.count() > offset:
-            entry = qs[offset:offset + 1].get()
-            qs.filter(created__lte=entry.created).delete()
+        return self.delete_expired_for_users([user.pk], offset)
+
+    def delete_expired_for_users(self, user_ids, offset=None):
+        """
+        Deletes the expired password history entries of several users with a
+        single statement.
+
+        :arg user_ids: The primary keys of the users.
+        :arg int offset: A number specifying how much entries are to be kept
+              in each user's password history. Defaults to the history count
+              of each user's policy.
+        :returns: The number of deleted entries.
+        :rtype: int
+        """
+        expired = (
+            self.filter(user__in=user_ids)
+            .annotate(
+                row_number=Window(
+                    RowNumber(), partition_by=F("user"), order_by=[F("created").desc(), F("pk").desc()]
+                ),
+                history_count=Value(offset) if offset else get_history_count_expression(),
+            )
+            .filter(row_number__gt=F("history_count"))
+            .values("pk")
+        )
+        deleted, _ = self.filter(pk__in=expired).delete()
+        return deleted
 
-    def check_password(self, user, raw_password):
+    def check_password(self, user, raw_password, offset=None):
         """
-        Compares a raw (UNENCRYPTED!!!) password to entries in the users's
-        password history.
+        Compares a raw (UNENCRYPTED!!!) password to the current password of the user
+        and to the entries in the users's password history.
 
         :arg object user: A :class:`~django.contrib.auth.models.User` instance.
         :arg str raw_password: A unicode string representing a password.
+        :arg int offset: The number of entries to check. Defaults to the history
+              count of the user's policy.
         :returns: ``False`` if a password has been used before, ``True`` if not.
         :rtype: bool
         """
-        result = True
-        if user.check_password(raw_password):
-            result = False
-        else:
-            entries = self.filter(user=user).all()[:self.default_offset]
-            for entry in entries:
-                hasher = identify_hasher(entry.password)
-                if hasher.verify(raw_password, entry.password):
-                    result = False
-                    break
-        return result
+        if not offset:
+            offset = get_user_policy(user).history_count
+        digest = get_password_digest(raw_password)
+        # The digests are compared to the latest entries only, like in `check_passwords`
+        entries = (
+            self.using(get_read_database(self.model, user))
+            .filter(user=user)
+            .order_by("-created", "-pk")
+            .values_list("password", "digest")[:offset]
+        )
+        encoded_passwords = get_passwords_to_verify(user, digest, entries)
+        if encoded_passwords is None:
+            return False
+        return not verify_any(raw_password, encoded_passwords)
+
+    def check_passwords(self, pairs, offset=None):
+        """
+        Batch version of :meth:`check_password`.
+
+        The history entries of all the users are loaded with a single query and
+        all the hashes are verified on the same thread pool.
+
+        :arg pairs: An iterable of `(user, raw_password)`.
+        :arg int offset: The number of entries to check per user. Defaults to
+              the history count of each user's policy.
+        :returns: For each pair, ``False`` if the password has been used before, ``True`` if not.
+        :rtype: list
+        """
+        pairs = list(pairs)
+
+        entries = defaultdict(list)
+        rows = (
+            self.using(get_read_database(self.model))
+            .filter(user__in={user.pk for user, _ in pairs})
+            .annotate(
+                row_number=Window(
+                    RowNumber(), partition_by=F("user"), order_by=[F("created").desc(), F("pk").desc()]
+                ),
+                history_count=Value(offset) if offset else get_history_count_expression(),
+            )
+            .filter(row_number__lte=F("history_count"))
+            .values_list("user", "password", "digest")
+        )
+        for user_id, password, digest in rows:
+            entries[user_id].append((password, digest))
+
+        results = [None] * len(pairs)
+        candidates = []
+        for index, (user, raw_password) in enumerate(pairs):
+            encoded_passwords = get_passwords_to_verify(
+                user, get_password_digest(raw_password), entries[user.pk]
+            )
+            if encoded_passwords is None:
+                results[index] = False
+            else:
+                candidates.append((index, raw_password, encoded_passwords))
+
+        matches = verify_many([(raw_password, encoded) for _, raw_password, encoded in candidates])
+        for (index, _, _), matched in zip(candidates, matches):
+            results[index] = not matched
+        return results
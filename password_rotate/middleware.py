@@ -1,62 +1,158 @@
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
 from django.contrib import messages
 from django.shortcuts import redirect
-from django.urls import resolve, reverse
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from django.utils.safestring import mark_safe
 
-from .utils import PasswordChecker, request_is_ajax
+from .exemptions import get_url_exemptions
+from .instrumentation import instrument
+from .utils import (
+    aget_password_checker, aget_user, get_password_checker, get_password_status, request_is_ajax
+)
+
+
+WARNING_SESSION_KEY = "_password_rotate_warning"
 
 
 class PasswordRotateMiddleware:
     """
     Adds Django message if password expires soon.
     Checks if user should be redirected to change password.
+
+    `request.password_status` is evaluated lazily: the password is only checked
+    when a page needs a warning or when something reads the status.
+    In async mode, the status of the pages needing a warning is evaluated with
+    the async ORM before calling the view. The other pages (POST, AJAX and exempt
+    requests) get "valid" since a lazy status would query the database from the
+    event loop.
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # The exemptions are compiled once
+        get_url_exemptions()
 
     def __call__(self, request):
-        request.password_status = "valid"
-        if self.is_page_for_warning(request):
-            force_password_change_path = reverse("force_password_change")
-            # add warning if within the notification window for password expiration
-            if request.user.is_authenticated:
-                checker = PasswordChecker(request.user)
-                msg = f"<a href='{force_password_change_path}'>Please change your password.</a> "
-                if checker.is_expired():
-                    if request.path != force_password_change_path:
-                        msg += "It has expired."
-                        self.add_warning(request, mark_safe(msg))
-                        request.password_status = "expired"
-                else:
-                    time_to_expire_string = checker.get_expire_time()
+        if self.async_mode:
+            return self.__acall__(request)
+
+        checker = SimpleLazyObject(partial(get_password_checker, request))
+        request.password_status = SimpleLazyObject(partial(get_password_status, request, checker))
+
+        with instrument("middleware") as measure:
+            if not self.is_page_for_warning(request):
+                measure.outcome = "exempt"
+            elif not request.user.is_authenticated:
+                measure.outcome = "anonymous"
+            else:
+                measure.outcome, response = self.check_password(request, checker)
+                if response is not None:
+                    return response
+
+        # picks up flag for forcing password change
+        if hasattr(request, "redirect_to_password_change"):
+            return redirect("force_password_change")
+
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        with instrument("middleware") as measure:
+            if not self.is_page_for_warning(request):
+                # The session and the user aren't loaded
+                request.password_status = "valid"
+                measure.outcome = "exempt"
+            else:
+                user = await aget_user(request)
+                if not user.is_authenticated:
                     request.password_status = "valid"
-                    if time_to_expire_string and request.path != force_password_change_path:
-                        msg += f"It expires in {time_to_expire_string}."
-                        self.add_warning(request, mark_safe(msg))
+                    measure.outcome = "anonymous"
+                else:
+                    checker = await aget_password_checker(request, user)
+                    request.password_status = "expired" if checker.is_expired() else "valid"
+                    measure.outcome, response = self.check_password(request, checker)
+                    if response is not None:
+                        return response
 
         # picks up flag for forcing password change
         if hasattr(request, "redirect_to_password_change"):
             return redirect("force_password_change")
 
+        return await self.get_response(request)
+
+    def check_password(self, request, checker):
+        """
+        Returns a redirection to the password change if the password expired.
+        Otherwise, adds a warning if the password expires soon.
+
+        :returns: The outcome of the check ("redirect", "warning", "warning_throttled"
+              or "valid") and the redirection or None.
+        """
         # At this point, if the password expired, the user should have been redirected to force_password
         # change and should have changed her password.
         # If the user didn't change her password, redirect her until it's done.
-        # If the password is still valid, just return the response.
-        if request.password_status == "valid":
-            return self.get_response(request)
-        elif request.password_status == "expired":
-            return redirect("force_password_change")
+        if checker.is_expired():
+            force_password_change_path = get_url_exemptions().reverse("force_password_change")
+            if request.path != force_password_change_path:
+                self.add_warning(request, self.get_message(force_password_change_path, "It has expired."))
+                return "redirect", redirect(force_password_change_path)
+        # add warning if within the notification window for password expiration
+        elif checker.is_warning():
+            force_password_change_path = get_url_exemptions().reverse("force_password_change")
+            if request.path != force_password_change_path:
+                if self.warn_expiration(request, checker, force_password_change_path):
+                    return "warning", None
+                return "warning_throttled", None
+        return "valid", None
 
     def is_page_for_warning(self, request):
         """
-        Only warn on pages that are GET requests and not ajax. Also ignore logouts.
+        Only warn on pages that are GET requests and not ajax.
+        Also ignore the pages exempted by `PASSWORD_ROTATE_EXEMPT_URLS` (logouts by default).
         """
-        if request.method == "GET" and not request_is_ajax(request):
-            match = resolve(request.path)
-            if match and match.url_name == "logout":
+        return (
+            request.method == "GET"
+            and not request_is_ajax(request)
+            and not get_url_exemptions().is_exempt(request.path)
+        )
+
+    def warn_expiration(self, request, checker, force_password_change_path):
+        """
+        Adds the warning of the upcoming expiration.
+
+        With `PASSWORD_ROTATE_WARN_INTERVAL` (in minutes), the warning is added at
+        most once per interval: the time of the last warning is kept in the session
+        so the other pages don't touch the messages.
+
+        :returns: False if the warning was skipped because of the interval.
+        """
+        interval = getattr(settings, "PASSWORD_ROTATE_WARN_INTERVAL", None)
+        session = getattr(request, "session", None)
+        if interval is None or session is None:
+            time_to_expire_string = checker.get_expire_time()
+        else:
+            now = timezone.now().timestamp()
+            warned = session.get(WARNING_SESSION_KEY)
+            if warned and now - warned["warned_at"] < interval * 60:
                 return False
-            return True
-        return False
+            time_to_expire_string = checker.get_expire_time()
+            session[WARNING_SESSION_KEY] = {"warned_at": now}
+        self.add_warning(
+            request,
+            self.get_message(force_password_change_path, f"It expires in {time_to_expire_string}.")
+        )
+        return True
+
+    def get_message(self, force_password_change_path, text):
+        return mark_safe(f"<a href='{force_password_change_path}'>Please change your password.</a> {text}")
 
     def add_warning(self, request, text):
         storage = messages.get_messages(request)
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("password_rotate", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="passwordhistory",
+            name="digest",
+            field=models.CharField(blank=True, help_text="The keyed digest of the password used to detect its reuse.", max_length=64, null=True, verbose_name="digest"),
+        ),
+        migrations.AddIndex(
+            model_name="passwordhistory",
+            index=models.Index(fields=["user", "digest"], name="password_ro_user_id_ef9ac3_idx"),
+        ),
+    ]
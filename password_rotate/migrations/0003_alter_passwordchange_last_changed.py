@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:42
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("password_rotate", "0002_passwordhistory_digest"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="passwordchange",
+            name="last_changed",
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:46
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def compute_expiry(apps, schema_editor):
+    PasswordChange = apps.get_model("password_rotate", "PasswordChange")
+    allowed_duration = timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS)
+    warning_duration = timedelta(seconds=settings.PASSWORD_ROTATE_WARN_SECONDS)
+    PasswordChange.objects.using(schema_editor.connection.alias).update(
+        expires_at=models.F("last_changed") + allowed_duration,
+        warn_at=models.F("last_changed") + (allowed_duration - warning_duration),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("password_rotate", "0003_alter_passwordchange_last_changed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="passwordchange",
+            name="expires_at",
+            field=models.DateTimeField(db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="passwordchange",
+            name="warn_at",
+            field=models.DateTimeField(db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(compute_expiry, migrations.RunPython.noop),
+    ]
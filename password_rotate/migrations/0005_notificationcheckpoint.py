@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("password_rotate", "0004_passwordchange_expires_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationCheckpoint",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=64, unique=True)),
+                ("last_run", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("password_rotate", "0005_notificationcheckpoint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="passwordchange",
+            name="policy",
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("password_rotate", "0006_passwordchange_policy"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationcheckpoint",
+            name="last_pk",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
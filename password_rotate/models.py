@@ -1,19 +1,40 @@
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from password_rotate.managers import PasswordHistoryManager
+from password_rotate.managers import PasswordChangeQuerySet, PasswordHistoryManager
+from password_rotate.policy import get_policy
 
 
 class PasswordChange(models.Model):
     """
     Records when users change a password to support an expiration policy
     """
-    last_changed = models.DateTimeField(db_index=True, auto_now_add=True)
+    last_changed = models.DateTimeField(db_index=True, default=timezone.now)
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Denormalized from `last_changed` and the settings to filter on the expiration
+    expires_at = models.DateTimeField(db_index=True, null=True, editable=False)
+    warn_at = models.DateTimeField(db_index=True, null=True, editable=False)
+    # The name of the policy of `PASSWORD_ROTATE_POLICIES` matching the user, None for the default policy
+    policy = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    objects = PasswordChangeQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.user.username}"
 
+    def save(self, *args, **kwargs):
+        self.set_expiry()
+        super().save(*args, **kwargs)
+
+    def set_expiry(self):
+        """
+        Computes `expires_at` and `warn_at` from `last_changed` and the policy of the user.
+        """
+        policy = get_policy(self.policy)
+        self.expires_at = policy.get_expiration(self.last_changed)
+        self.warn_at = policy.get_warning(self.last_changed)
+
 
 class PasswordHistory(models.Model):
     """
@@ -25,6 +46,10 @@ class PasswordHistory(models.Model):
     password = models.CharField(
         max_length=128, verbose_name=_("password"), help_text=_("The encrypted password.")
     )
+    digest = models.CharField(
+        max_length=64, null=True, blank=True, verbose_name=_("digest"),
+        help_text=_("The keyed digest of the password used to detect its reuse."),
+    )
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         verbose_name=_("user"),
@@ -43,3 +68,19 @@ class PasswordHistory(models.Model):
         ordering = ["-created"]
         verbose_name = _("password history entry")
         verbose_name_plural = _("password history entries")
+        indexes = [models.Index(fields=["user", "digest"])]
+
+
+class NotificationCheckpoint(models.Model):
+    """
+    Records the time of the last run of a notification command, so that the next
+    run only processes the users who crossed the threshold since then.
+    """
+    name = models.CharField(max_length=64, unique=True)
+    last_run = models.DateTimeField()
+    # The last processed `PasswordChange` crossing the threshold at `last_run`,
+    # None once the run completed
+    last_pk = models.BigIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} - {self.last_run}"
@@ -0,0 +1,153 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+class RotationPolicy:
+    """
+    The rotation rules, read once from the settings.
+
+    The default policy has no name. The policies of `PASSWORD_ROTATE_POLICIES`
+    are identified by their name, which is stored with the `PasswordChange` of
+    their users.
+    """
+    __slots__ = ("name", "allowed_duration", "warning_duration", "history_count", "exclude_superusers")
+
+    def __init__(self, seconds, warn_seconds, history_count, exclude_superusers=False, name=None):
+        self.name = name
+        # password expires: last_changed + allowed_duration
+        self.allowed_duration = timedelta(seconds=seconds)
+        # start warning at password expiration - warning_duration
+        self.warning_duration = timedelta(seconds=warn_seconds)
+        self.history_count = history_count
+        self.exclude_superusers = exclude_superusers
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            seconds=settings.PASSWORD_ROTATE_SECONDS,
+            warn_seconds=settings.PASSWORD_ROTATE_WARN_SECONDS,
+            history_count=settings.PASSWORD_ROTATE_HISTORY_COUNT,
+            # admin can configure so superusers are excluded from check
+            exclude_superusers=getattr(settings, "PASSWORD_ROTATE_EXCLUDE_SUPERUSERS", False),
+        )
+
+    def get_expiration(self, last_changed):
+        return last_changed + self.allowed_duration
+
+    def get_warning(self, last_changed):
+        return last_changed + self.allowed_duration - self.warning_duration
+
+    def is_user_excluded(self, user):
+        return self.exclude_superusers and user.is_superuser
+
+
+class PolicyRule:
+    """
+    Matches the users of a policy of `PASSWORD_ROTATE_POLICIES`: the members of
+    one of its `groups` or the users with a truthy `attribute` (ex: "is_staff").
+    """
+    __slots__ = ("policy", "groups", "attribute")
+
+    def __init__(self, policy, groups=(), attribute=None):
+        self.policy = policy
+        self.groups = frozenset(groups)
+        self.attribute = attribute
+
+    def matches(self, user, group_names):
+        if self.attribute and getattr(user, self.attribute, False):
+            return True
+        return bool(self.groups & group_names())
+
+
+_policy = None
+_policies = {}
+_rules = []
+
+
+def get_policy(name=None):
+    """
+    Returns the `RotationPolicy` named `name`, or the default one built from the
+    settings when `name` is None or isn't configured anymore.
+    """
+    if _policy is None:
+        build_policy()
+    if name is None:
+        return _policy
+    return _policies.get(name, _policy)
+
+
+def get_policies():
+    """
+    Returns the default policy followed by the policies of `PASSWORD_ROTATE_POLICIES`.
+    """
+    get_policy()
+    return [_policy, *_policies.values()]
+
+
+def resolve_policy(user):
+    """
+    Returns the policy of the first rule of `PASSWORD_ROTATE_POLICIES` matching
+    the user, or the default policy.
+
+    The groups of the user are only queried when a rule needs them.
+    """
+    get_policy()
+    groups = None
+
+    def group_names():
+        nonlocal groups
+        if groups is None:
+            # uses the groups prefetched with `prefetch_related("groups")`
+            groups = {group.name for group in user.groups.all()} if user.pk else set()
+        return groups
+
+    for rule in _rules:
+        if rule.matches(user, group_names):
+            return rule.policy
+    return _policy
+
+
+def get_user_policy(user):
+    """
+    Returns the policy stored with the `PasswordChange` of the user.
+    """
+    if not _policies:
+        return get_policy()
+    try:
+        name = user.passwordchange.policy
+    except ObjectDoesNotExist:
+        name = None
+    return get_policy(name)
+
+
+def build_policy():
+    global _policy, _policies, _rules
+    default = RotationPolicy.from_settings()
+    policies = {}
+    rules = []
+    for options in getattr(settings, "PASSWORD_ROTATE_POLICIES", []):
+        name = options.get("name")
+        if not name or name in policies:
+            raise ImproperlyConfigured("Each policy of PASSWORD_ROTATE_POLICIES requires a unique name.")
+        if not options.get("groups") and not options.get("attribute"):
+            raise ImproperlyConfigured(f"The policy {name!r} requires groups or an attribute.")
+        policy = RotationPolicy(
+            seconds=options.get("seconds", settings.PASSWORD_ROTATE_SECONDS),
+            warn_seconds=options.get("warn_seconds", settings.PASSWORD_ROTATE_WARN_SECONDS),
+            history_count=options.get("history_count", settings.PASSWORD_ROTATE_HISTORY_COUNT),
+            exclude_superusers=default.exclude_superusers,
+            name=name,
+        )
+        policies[name] = policy
+        rules.append(PolicyRule(policy, options.get("groups", ()), options.get("attribute")))
+    _policy, _policies, _rules = default, policies, rules
+
+
+@receiver(setting_changed)
+def rebuild_policy(*, setting, **kwargs):
+    if setting.startswith("PASSWORD_ROTATE_"):
+        build_policy()
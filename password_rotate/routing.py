@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.db import router
+
+from .cache import get_shared_cache
+
+
+def get_read_database(model, user=None):
+    """
+    Returns the database alias of the read-only lookups of password_rotate.
+
+    `PASSWORD_ROTATE_READ_DATABASE` sends them to a replica, except for the
+    users pinned to the primary after a password change.
+    Otherwise, the alias is chosen by the database routers.
+    """
+    alias = getattr(settings, "PASSWORD_ROTATE_READ_DATABASE", None)
+    if alias is None:
+        return router.db_for_read(model)
+    if user is not None and user.pk is not None and get_shared_cache().get(get_pin_key(user.pk)):
+        return router.db_for_write(model)
+    return alias
+
+
+async def aget_read_database(model, user=None):
+    """
+    Async version of `get_read_database`.
+    """
+    alias = getattr(settings, "PASSWORD_ROTATE_READ_DATABASE", None)
+    if alias is None:
+        return router.db_for_read(model)
+    if user is not None and user.pk is not None and await get_shared_cache().aget(get_pin_key(user.pk)):
+        return router.db_for_write(model)
+    return alias
+
+
+def get_pin_key(user_id):
+    return f"password_rotate:pin:{user_id}"
+
+
+def pin_to_primary(user_id):
+    """
+    Reads the password changes of the user from the primary database during
+    `PASSWORD_ROTATE_READ_PIN_SECONDS`, so that the replica lag can't expire the
+    password again right after its change.
+    """
+    seconds = getattr(settings, "PASSWORD_ROTATE_READ_PIN_SECONDS", 60)
+    if getattr(settings, "PASSWORD_ROTATE_READ_DATABASE", None) is None or not seconds:
+        return
+    get_shared_cache().set(get_pin_key(user_id), True, seconds)
@@ -1,51 +1,139 @@
+from functools import partial
+
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import get_user_model, user_logged_in
+from django.db import connections, router, transaction
 from django.db.models import signals
 from django.utils import timezone
 
+from . import cache
+from .hashers import make_history_password
+from .instrumentation import instrumented
+from .managers import get_password_digest
 from .models import PasswordChange, PasswordHistory
-from .utils import PasswordChecker
+from .policy import get_policies, resolve_policy
+from .routing import get_read_database, pin_to_primary
+from .utils import PasswordChecker, cache_password_status, session_cache_enabled
 
 
+@instrumented("create_user_handler")
 def create_user_handler(sender, instance, created, **kwargs):
     # when the user is created, set the password last changed field to now.
     # Create the new row in PasswordHistory and delete the old one if necessary.
     if created:
         now = timezone.now()
-        PasswordChange.objects.create(user=instance, last_changed=now)
-        PasswordHistory.objects.create(user=instance, created=now, password=instance.password)
-        PasswordHistory.objects.delete_expired(instance)
+        policy = resolve_policy(instance)
+        record = PasswordChange.objects.create(user=instance, last_changed=now, policy=policy.name)
+        # A rolled back user shouldn't stay in the cache
+        transaction.on_commit(
+            partial(cache.set_password_change, instance.pk, record.last_changed, policy.name),
+            using=router.db_for_write(PasswordChange),
+        )
+        PasswordHistory.objects.create(
+            user=instance, created=now, password=make_history_password(instance._password, instance.password),
+            digest=get_password_digest(instance._password),
+        )
+        PasswordHistory.objects.delete_expired(instance, policy.history_count)
 
 
+@instrumented("change_password_handler")
 def change_password_handler(sender, instance, **kwargs):
     # Checks if the user changed password
     # contrib/auth/base_user.py sets _password in set_password()
     if instance._password is None:
         return
 
-    try:
-        get_user_model().objects.get(id=instance.id)
-    except get_user_model().DoesNotExist:
+    # New users are handled by create_user_handler
+    if instance._state.adding or instance.pk is None:
         return
 
     # We update the PasswordChange, create a new row in PasswordHistory and delete an old row if necessary
     now = timezone.now()
-    record, _ = PasswordChange.objects.get_or_create(user=instance)
-    record.last_changed = now
-    record.save()
+    policy = resolve_policy(instance)
+    with transaction.atomic(using=router.db_for_write(PasswordChange)):
+        upsert_password_change(instance, now, policy)
+
+        # NOTE When changing the password, `set_password` is called 2 times: 1 time when the
+        # the form in ForcePasswordChangeView is saved and another time after this view.
+        # We allow only the 1st storage of the password.
+        if getattr(instance, '_has_not_previous_password', False):
+            PasswordHistory.objects.create(
+                user=instance, created=now, password=make_history_password(instance._password, instance.password),
+                digest=get_password_digest(instance._password),
+            )
+            PasswordHistory.objects.delete_expired(instance, policy.history_count)
+            instance._has_not_previous_password = False
+    # The replicas may not have the new password change yet
+    pin_to_primary(instance.pk)
+    transaction.on_commit(
+        partial(cache.set_password_change, instance.pk, now, policy.name),
+        using=router.db_for_write(PasswordChange),
+    )
+
+
+def upsert_password_change(user, last_changed, policy):
+    """
+    Creates or updates the `PasswordChange` of the user with a single query.
+    """
+    connection = connections[router.db_for_write(PasswordChange)]
+    # MySQL doesn't support the conflict target
+    unique_fields = ["user"] if connection.features.supports_update_conflicts_with_target else None
+    record = PasswordChange(user=user, last_changed=last_changed, policy=policy.name)
+    record.set_expiry()
+    PasswordChange.objects.bulk_create(
+        [record],
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=["last_changed", "expires_at", "warn_at", "policy"],
+    )
+
+
+def store_policy(user, policy):
+    """
+    Stores the policy with the `PasswordChange` of the user if it changed.
+    """
+    if PasswordChange.objects.filter(user=user).exclude(policy=policy.name).set_policy(policy):
+        cache.delete_password_change(user.pk)
+        # Invalidates the policy stored in the sessions of the user
+        cache.bump_policy_version(user.pk)
+
+
+def invalidate_cache_handler(sender, instance, **kwargs):
+    # PasswordChange can also be edited outside of the handlers above (in the admin for example)
+    cache.delete_password_change(instance.user_id)
 
-    # NOTE When changing the password, `set_password` is called 2 times: 1 time when the
-    # the form in ForcePasswordChangeView is saved and another time after this view.
-    # We allow only the 1st storage of the password.
-    if getattr(instance, '_has_not_previous_password', False):
-        PasswordHistory.objects.create(user=instance, created=now, password=instance.password)
-        PasswordHistory.objects.delete_expired(instance)
-        instance._has_not_previous_password = False
+
+def groups_changed_handler(sender, instance, action, reverse, pk_set, **kwargs):
+    # The policies may depend on the groups of the users
+    if len(get_policies()) == 1:
+        return
+    if not reverse:
+        users = [instance]
+    elif action == "pre_clear":
+        # The members of the group are unknown after the clear
+        instance._password_rotate_members = list(instance.user_set.values_list("pk", flat=True))
+        return
+    else:
+        if action == "post_clear":
+            pk_set = getattr(instance, "_password_rotate_members", [])
+        users = get_user_model().objects.filter(pk__in=pk_set or []).prefetch_related("groups")
+    if action in ("post_add", "post_remove", "post_clear"):
+        for user in users:
+            store_policy(user, resolve_policy(user))
 
 
+@instrumented("login_handler")
 def login_handler(sender, request, user, **kwargs):
-    checker = PasswordChecker(user)
+    checker = PasswordChecker(user, using=get_read_database(PasswordChange, user))
+    policy = resolve_policy(user)
+    if policy is not checker.policy:
+        # The attributes of the user changed since the policy was stored
+        store_policy(user, policy)
+        checker = PasswordChecker(user, last_changed=checker.last_changed, policy=policy)
+    if session_cache_enabled() and request is not None and hasattr(request, "session"):
+        cache_password_status(request, checker, cache.get_policy_version(user.pk))
+
     if checker.is_expired():
         # Login with expired password then redirect to change the password.
         # This solution is faster and probably as safe as resetting the password
@@ -69,6 +157,25 @@ def register_signals():
         dispatch_uid="password_rotate:change_password_handler",
     )
 
+    signals.post_save.connect(
+        invalidate_cache_handler,
+        sender=PasswordChange,
+        dispatch_uid="password_rotate:invalidate_cache_on_save",
+    )
+
+    signals.post_delete.connect(
+        invalidate_cache_handler,
+        sender=PasswordChange,
+        dispatch_uid="password_rotate:invalidate_cache_on_delete",
+    )
+
+    if hasattr(get_user_model(), "groups"):
+        signals.m2m_changed.connect(
+            groups_changed_handler,
+            sender=get_user_model().groups.through,
+            dispatch_uid="password_rotate:groups_changed_handler",
+        )
+
     user_logged_in.connect(
         login_handler,
         dispatch_uid="password_rotate:login_handler"
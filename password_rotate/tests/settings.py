@@ -43,6 +43,10 @@ DATABASES = {
         "PASSWORD": "",
         "PORT": "",
     },
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+    },
 }
 
 AUTH_PASSWORD_VALIDATORS = [
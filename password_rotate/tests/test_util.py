@@ -1,15 +1,39 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
 from datetime import timedelta
+from io import StringIO
 from unittest import mock
 
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
 from django.contrib.auth.hashers import identify_hasher
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core import mail
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from django.urls import reverse
+from django.urls import reverse, set_script_prefix
 
-from password_rotate.models import PasswordChange, PasswordHistory
-from password_rotate.utils import PasswordChecker
+from password_rotate.exemptions import UrlExemptions
+from password_rotate.hashers import check_history_password
+from password_rotate.instrumentation import get_collector
+from password_rotate.middleware import WARNING_SESSION_KEY, PasswordRotateMiddleware
+from password_rotate.models import NotificationCheckpoint, PasswordChange, PasswordHistory
+from password_rotate.policy import RotationPolicy, get_policy
+from password_rotate.breached import BreachedPasswordFile
+from password_rotate.validators import BreachedPasswordValidator, DictionarySimilarityValidator
+from password_rotate.utils import SESSION_KEY, PasswordChecker, annotate_password_status, provision_users
 
 
 def do_nothing(*args, **kwargs):
@@ -305,3 +329,1177 @@ class PasswordSimilarityRatioTest(BaseTestCase):
 
         # There should be 2 rows
         self.assertEqual(PasswordHistory.objects.filter(user=user).count(), 2)
+
+
+@override_settings(PASSWORD_ROTATE_SESSION_CACHE=True)
+class SessionCacheTests(BaseTestCase):
+    def test_login_caches_password_status(self):
+        """
+        The date of the last password change should be stored in the session at login
+        """
+        # ARRANGE
+        user = create_user()
+
+        # ACT
+        self.client.login(username="bob", password="password")
+
+        # ASSERT
+        record = PasswordChange.objects.get(user=user)
+        self.assertEqual(
+            self.client.session[SESSION_KEY]["last_changed"], record.last_changed.isoformat()
+        )
+
+    def test_middleware_uses_cached_password_status(self):
+        """
+        Once cached, the password status should be computed without querying `PasswordChange`
+        """
+        # ARRANGE
+        create_user()
+        self.client.login(username="bob", password="password")
+
+        # ACT
+        with mock.patch.object(PasswordChecker, "get_password_change") as get_password_change:
+            response = self.client.get("/some_page/")
+
+        # ASSERT
+        self.assertEqual(response.status_code, 200)
+        get_password_change.assert_not_called()
+
+    @mock.patch("password_rotate.signals.messages", side_effect=do_nothing())
+    def test_cached_password_status_is_invalidated_by_password_change(self, messages):
+        """
+        Changing the password should invalidate the cached status so that the user
+        isn't redirected anymore
+        """
+        # ARRANGE
+        user = create_user()
+        record = PasswordChange.objects.get(user=user)
+        record.last_changed = timezone.now() - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS + 1)
+        record.save()
+        self.client.login(username="bob", password="password")
+        self.assertEqual(self.client.get("/some_page/").status_code, 302)
+
+        # ACT
+        self.force_password_change("password", "some new words")
+
+        # ASSERT
+        self.assertEqual(self.client.get("/some_page/").status_code, 200)
+        record.refresh_from_db()
+        self.assertEqual(
+            self.client.session[SESSION_KEY]["last_changed"], record.last_changed.isoformat()
+        )
+
+
+@override_settings(PASSWORD_ROTATE_CACHE="default")
+class CacheBackendTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_last_changed_is_read_from_cache(self):
+        """
+        Once a user has been created, the checker shouldn't query `PasswordChange`
+        """
+        # ARRANGE
+        with self.captureOnCommitCallbacks(execute=True):
+            user = create_user()
+
+        # ACT
+        with self.assertNumQueries(0):
+            checker = PasswordChecker(user)
+
+        # ASSERT
+        self.assertEqual(checker.last_changed, PasswordChange.objects.get(user=user).last_changed)
+
+    def test_cache_miss_falls_back_to_date_joined(self):
+        # ARRANGE
+        join_date = timezone.now() - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS + 1)
+        user = create_user(date_joined=join_date)
+        PasswordChange.objects.all().delete()
+
+        # ACT
+        with self.assertNumQueries(1):
+            checker = PasswordChecker(user)
+
+        # ASSERT
+        self.assertEqual(checker.last_changed, join_date)
+        self.assertTrue(checker.is_expired())
+        # The fallback is cached as well
+        with self.assertNumQueries(0):
+            PasswordChecker(user)
+
+    def test_cache_is_refreshed_by_password_change(self):
+        # ARRANGE
+        user = create_user()
+        record = PasswordChange.objects.get(user=user)
+        record.last_changed = timezone.now() - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS + 1)
+        record.save()
+        self.assertTrue(PasswordChecker(user).is_expired())
+
+        # ACT
+        with self.captureOnCommitCallbacks(execute=True):
+            user.set_password("some new words")
+            user.save()
+
+        # ASSERT
+        self.assertFalse(PasswordChecker(user).is_expired())
+
+    def test_cache_not_written_by_rolled_back_change(self):
+        """
+        The cache should only be written once the password change is committed
+        """
+        # ARRANGE
+        user = create_user()
+        record = PasswordChange.objects.get(user=user)
+        record.last_changed = timezone.now() - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS + 1)
+        record.save()
+
+        # ACT
+        try:
+            with transaction.atomic():
+                user.set_password("some new words")
+                user.save()
+                raise IntegrityError
+        except IntegrityError:
+            pass
+
+        # ASSERT
+        self.assertTrue(PasswordChecker(user).is_expired())
+
+
+class LazyPasswordStatusTests(BaseTestCase):
+    def test_password_not_checked_when_status_not_needed(self):
+        """
+        Pages without warning that don't read the password status shouldn't check the password
+        """
+        # ARRANGE
+        create_user()
+        self.client.login(username="bob", password="password")
+
+        # ACT
+        with mock.patch.object(PasswordChecker, "get_password_change") as get_password_change:
+            response = self.client.post("/some_page/")
+
+        # ASSERT
+        self.assertEqual(response.status_code, 200)
+        get_password_change.assert_not_called()
+
+    @mock.patch("password_rotate.signals.messages", side_effect=do_nothing())
+    def test_password_checked_when_status_is_read(self, messages):
+        # ARRANGE
+        user = create_user()
+        record = PasswordChange.objects.get(user=user)
+        record.last_changed = timezone.now() - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS + 1)
+        record.save()
+        self.client.login(username="bob", password="password")
+
+        # ACT
+        response = self.client.post("/password_status/")
+
+        # ASSERT
+        self.assertContains(response, "expired")
+
+    def test_anonymous_password_status(self):
+        self.assertContains(self.client.post("/password_status/"), "valid")
+
+
+class WarningIntervalTests(BaseTestCase):
+    @override_settings(
+        PASSWORD_ROTATE_WARN_INTERVAL=30,
+        PASSWORD_ROTATE_INSTRUMENTATION="password_rotate.instrumentation.InMemoryCollector",
+    )
+    def test_warning_throttled(self):
+        """
+        The warning should be added at most once per interval
+        """
+        # ARRANGE
+        user = create_user()
+        record = PasswordChange.objects.get(user=user)
+        record.last_changed = timezone.now() - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS - 150)
+        record.save()
+        self.client.login(username="bob", password="password")
+
+        # ACT
+        with mock.patch.object(PasswordRotateMiddleware, "add_warning") as add_warning:
+            self.client.get("/some_page/")
+            self.client.get("/some_page/")
+            session = self.client.session
+            warned = session[WARNING_SESSION_KEY]
+            warned["warned_at"] -= 30 * 60
+            session[WARNING_SESSION_KEY] = warned
+            session.save()
+            self.client.get("/some_page/")
+
+        # ASSERT
+        self.assertEqual(add_warning.call_count, 2)
+        self.assertIn("It expires in 2 minutes.", add_warning.call_args.args[1])
+        collector = get_collector()
+        self.assertEqual(collector.counters[("middleware", "warning")], 2)
+        self.assertEqual(collector.counters[("middleware", "warning_throttled")], 1)
+
+
+@override_settings(PASSWORD_ROTATE_READ_DATABASE="replica")
+class ReadDatabaseTests(BaseTestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        super().setUp()
+        # The users are pinned to the primary in the cache
+        cache.clear()
+
+    def get_password_change_queries(self, alias, func):
+        with CaptureQueriesContext(connections[alias]) as queries:
+            func()
+        return [query["sql"] for query in queries if "password_rotate_passwordchange" in query["sql"]]
+
+    def replicate(self, user, last_changed):
+        """
+        Copies the user to the replica (without signals) with another date of last password change
+        """
+        get_user_model().objects.using("replica").bulk_create([user])
+        PasswordChange.objects.using("replica").bulk_create([PasswordChange(user=user, last_changed=last_changed)])
+
+    @mock.patch("password_rotate.signals.messages", side_effect=do_nothing())
+    def test_checker_on_replica(self, messages):
+        # ARRANGE
+        user = create_user()
+        last_changed = timezone.now() - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS + 1)
+        self.replicate(user, last_changed)
+        self.client.login(username="bob", password="password")
+
+        # ACT
+        replica_queries = self.get_password_change_queries("replica", lambda: self.client.get("/some_page/"))
+        primary_queries = self.get_password_change_queries("default", lambda: self.client.get("/some_page/"))
+
+        # ASSERT
+        self.assertEqual(len(replica_queries), 1)
+        self.assertEqual(primary_queries, [])
+        # The date of the replica is read: the password expired there
+        self.assertEqual(self.client.get("/some_page/").status_code, 302)
+        self.assertEqual(PasswordChecker(user, using="replica").last_changed, last_changed)
+
+    def test_history_on_replica(self):
+        # ARRANGE
+        user = create_user()
+
+        # ACT
+        with CaptureQueriesContext(connections["replica"]) as queries:
+            PasswordHistory.objects.check_password(user, "Hello world")
+
+        # ASSERT
+        self.assertIn("password_rotate_passwordhistory", queries[0]["sql"])
+
+    @mock.patch("password_rotate.signals.messages", side_effect=do_nothing())
+    def test_pinned_to_primary_after_any_change(self, messages):
+        """
+        The login after a password change outside of the views (reset, admin...) should read the primary
+        """
+        # ARRANGE
+        user = create_user()
+        user.set_password("Hello world 1")
+        user.save()
+
+        # ACT
+        replica_queries = self.get_password_change_queries(
+            "replica", lambda: self.client.login(username="bob", password="Hello world 1")
+        )
+
+        # ASSERT
+        self.assertEqual(replica_queries, [])
+
+    @mock.patch("password_rotate.signals.messages", side_effect=do_nothing())
+    def test_pinned_to_primary_after_change(self, messages):
+        """
+        The session should read from the primary right after a password change
+        """
+        # ARRANGE
+        create_user()
+        self.client.login(username="bob", password="password")
+        self.force_password_change("password", "Hello world 1")
+
+        # ACT
+        replica_queries = self.get_password_change_queries("replica", lambda: self.client.get("/some_page/"))
+        primary_queries = self.get_password_change_queries("default", lambda: self.client.get("/some_page/"))
+
+        # ASSERT
+        self.assertEqual(replica_queries, [])
+        self.assertEqual(len(primary_queries), 1)
+
+
+class UrlExemptionsTests(BaseTestCase):
+    def test_exemptions(self):
+        exemptions = UrlExemptions(["logout", "/static/", re.compile(r"/health/?$"), "unknown"])
+
+        self.assertTrue(exemptions.is_exempt(reverse("logout")))
+        self.assertTrue(exemptions.is_exempt("/static/css/style.css"))
+        self.assertTrue(exemptions.is_exempt("/health"))
+        self.assertFalse(exemptions.is_exempt("/health/check/"))
+        self.assertFalse(exemptions.is_exempt("/some_page/"))
+
+    def test_exemptions_with_script_prefix(self):
+        """
+        The URL names should be reversed again when the application is mounted under another prefix
+        """
+        exemptions = UrlExemptions(["logout"])
+        self.assertTrue(exemptions.is_exempt("/logout/"))
+
+        set_script_prefix("/app/")
+        try:
+            self.assertTrue(exemptions.is_exempt("/app/logout/"))
+            self.assertEqual(exemptions.reverse("logout"), "/app/logout/")
+        finally:
+            set_script_prefix("/")
+        self.assertFalse(exemptions.is_exempt("/app/logout/"))
+
+    @override_settings(PASSWORD_ROTATE_EXEMPT_URLS=["/some_page/"])
+    @mock.patch("password_rotate.signals.messages", side_effect=do_nothing())
+    def test_no_redirection_on_exempt_pages(self, messages):
+        # ARRANGE
+        # The password expired
+        user = create_user()
+        record = PasswordChange.objects.get(user=user)
+        record.last_changed = timezone.now() - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS + 1)
+        record.save()
+        self.client.login(username="bob", password="password")
+
+        # ACT
+        responses = {path: self.client.get(path) for path in ["/some_page/", "/admin/"]}
+
+        # ASSERT
+        self.assertEqual(responses["/some_page/"].status_code, 200)
+        self.assertEqual(responses["/admin/"].status_code, 302)
+
+
+class AsyncMiddlewareTests(BaseTestCase):
+    def test_middleware_is_async_with_async_get_response(self):
+        async def get_response(request):
+            pass
+
+        self.assertTrue(iscoroutinefunction(PasswordRotateMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(PasswordRotateMiddleware(lambda request: None)))
+
+    async def test_checker_created_with_async_orm(self):
+        # ARRANGE
+        join_date = timezone.now() - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS + 1)
+        user = await sync_to_async(create_user)(date_joined=join_date)
+        record = await PasswordChange.objects.aget(user=user)
+
+        # ACT
+        checker = await PasswordChecker.acreate(user)
+
+        # ASSERT
+        self.assertEqual(checker.last_changed, record.last_changed)
+        self.assertFalse(checker.is_expired())
+
+    @mock.patch("password_rotate.signals.messages", side_effect=do_nothing())
+    async def test_redirection_while_password_not_changed(self, messages):
+        # ARRANGE
+        # The password expired
+        user = await sync_to_async(create_user)()
+        await PasswordChange.objects.filter(user=user).aupdate(
+            last_changed=timezone.now() - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS + 1)
+        )
+        await sync_to_async(self.async_client.login)(username="bob", password="password")
+        fpc_url = reverse("force_password_change")
+
+        # ACT
+        responses = {path: await self.async_client.get(path) for path in ["/some_page/", fpc_url]}
+
+        # ASSERT
+        self.assertEqual(responses["/some_page/"].status_code, 302)
+        self.assertEqual(responses["/some_page/"]["Location"], fpc_url)
+        self.assertEqual(responses[fpc_url].status_code, 200)
+
+    @override_settings(PASSWORD_ROTATE_EXEMPT_URLS=["/some_page/"])
+    async def test_password_not_checked_on_exempt_requests(self):
+        """
+        As in sync mode, the user and the password shouldn't be loaded on pages without warning
+        """
+        # ARRANGE
+        requests = []
+
+        async def get_response(request):
+            requests.append(request)
+
+        middleware = PasswordRotateMiddleware(get_response)
+        factory = AsyncRequestFactory()
+
+        # ACT
+        with mock.patch("password_rotate.middleware.aget_user") as aget_user:
+            await middleware(factory.get("/some_page/"))
+            await middleware(factory.post("/password_status/"))
+
+        # ASSERT
+        aget_user.assert_not_called()
+        # The status can be read by async views
+        self.assertEqual([request.password_status for request in requests], ["valid", "valid"])
+
+    async def test_cache_read_with_async_api(self):
+        """
+        The cache backend shouldn't block the event loop
+        """
+        # ARRANGE
+        user = await sync_to_async(create_user)()
+        last_changed = timezone.now() - timedelta(days=1)
+        backend = mock.Mock(aget=mock.AsyncMock(return_value=(last_changed, None)))
+
+        # ACT
+        with mock.patch("password_rotate.cache.get_cache", return_value=backend):
+            checker = await PasswordChecker.acreate(user)
+
+        # ASSERT
+        self.assertEqual(checker.last_changed, last_changed)
+        backend.get.assert_not_called()
+
+
+class PasswordHistoryCheckTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user()
+        for raw_password in ["Hello world", "Bonjour le monde"]:
+            self.user._has_not_previous_password = True
+            self.user.set_password(raw_password)
+            self.user.save()
+
+    def test_identical_hashes_are_verified_once(self):
+        """
+        The latest history entry is the current password, it should be verified only once
+        """
+        with mock.patch("password_rotate.managers.check_history_password", wraps=check_history_password) as check:
+            self.assertTrue(PasswordHistory.objects.check_password(self.user, "Goodbye world"))
+
+        self.assertEqual(check.call_count, settings.PASSWORD_ROTATE_HISTORY_COUNT)
+
+    def test_previous_passwords(self):
+        for workers in [1, 4]:
+            with self.subTest(workers=workers), self.settings(PASSWORD_ROTATE_HISTORY_WORKERS=workers):
+                self.assertFalse(PasswordHistory.objects.check_password(self.user, "password"))
+                self.assertFalse(PasswordHistory.objects.check_password(self.user, "Bonjour le monde"))
+                self.assertTrue(PasswordHistory.objects.check_password(self.user, "Goodbye world"))
+
+    def test_batch_check(self):
+        """
+        The history of all the users should be loaded with a single query
+        """
+        # ARRANGE
+        alice = create_user(username="alice", password="Hello world")
+        pairs = [
+            (self.user, "password"),
+            (self.user, "Goodbye world"),
+            (alice, "Hello world"),
+            (alice, "password"),
+        ]
+
+        # ACT
+        for pepper in [None, "pepper"]:
+            with self.subTest(pepper=pepper), self.settings(PASSWORD_ROTATE_HISTORY_PEPPER=pepper):
+                with self.assertNumQueries(1):
+                    results = PasswordHistory.objects.check_passwords(pairs)
+
+                # ASSERT
+                self.assertEqual(results, [False, True, False, True])
+
+
+@override_settings(PASSWORD_ROTATE_HISTORY_HASHER="password_rotate.hashers.HistoryPBKDF2PasswordHasher")
+class PasswordHistoryHasherTests(BaseTestCase):
+    def test_history_hasher(self):
+        """
+        The history should be hashed with the history hasher, even if it isn't in PASSWORD_HASHERS
+        """
+        # ARRANGE
+        user = create_user()
+        user._has_not_previous_password = True
+        user.set_password("Hello world")
+        user.save()
+
+        # ACT
+        passwords = list(PasswordHistory.objects.values_list("password", flat=True))
+
+        # ASSERT
+        self.assertEqual(len(passwords), 2)
+        for password in passwords:
+            self.assertTrue(password.startswith("history_pbkdf2_sha256$100000$"))
+        self.assertFalse(PasswordHistory.objects.check_password(user, "password"))
+        self.assertFalse(PasswordHistory.objects.check_password(user, "Hello world"))
+        self.assertTrue(PasswordHistory.objects.check_password(user, "Goodbye world"))
+
+    def test_verify_budget(self):
+        """
+        The reuse of a password is accepted when its verification exceeds the time budget
+        """
+        # ARRANGE
+        user = create_user()
+
+        for workers in [1, 4]:
+            with self.subTest(workers=workers), self.settings(
+                PASSWORD_ROTATE_HISTORY_WORKERS=workers, PASSWORD_ROTATE_HISTORY_VERIFY_BUDGET=0
+            ):
+                # ACT
+                with self.assertLogs("password_rotate", "WARNING") as logs:
+                    result = PasswordHistory.objects.check_password(user, "password")
+
+                # ASSERT
+                self.assertTrue(result)
+                self.assertIn("PASSWORD_ROTATE_HISTORY_VERIFY_BUDGET", logs.output[0])
+
+
+@override_settings(PASSWORD_ROTATE_HISTORY_PEPPER="pepper")
+class PasswordHistoryDigestTests(BaseTestCase):
+    def test_reuse_detected_with_digest(self):
+        """
+        A password stored with a digest should be detected without verifying any hash
+        """
+        # ARRANGE
+        user = create_user()
+        user._has_not_previous_password = True
+        user.set_password("Hello world")
+        user.save()
+
+        # ACT
+        with mock.patch("password_rotate.managers.check_history_password") as check:
+            result = PasswordHistory.objects.check_password(user, "password")
+
+        # ASSERT
+        self.assertFalse(result)
+        check.assert_not_called()
+        self.assertFalse(PasswordHistory.objects.filter(digest__isnull=True).exists())
+
+    def test_digest_of_older_entries_ignored(self):
+        """
+        Only the latest entries should be compared, as in `check_passwords`
+        """
+        # ARRANGE
+        user = create_user()
+        user._has_not_previous_password = True
+        user.set_password("Hello world")
+        user.save()
+
+        # ACT / ASSERT
+        self.assertTrue(PasswordHistory.objects.check_password(user, "password", offset=1))
+        self.assertEqual(PasswordHistory.objects.check_passwords([(user, "password")], offset=1), [True])
+        self.assertFalse(PasswordHistory.objects.check_password(user, "password", offset=2))
+
+    def test_legacy_entries_are_verified(self):
+        # ARRANGE
+        user = create_user()
+        PasswordHistory.objects.update(digest=None)
+
+        # ACT / ASSERT
+        self.assertFalse(PasswordHistory.objects.check_password(user, "password"))
+        self.assertTrue(PasswordHistory.objects.check_password(user, "Hello world"))
+
+    def test_coverage_command(self):
+        # ARRANGE
+        create_user()
+        create_user(username="alice")
+        PasswordHistory.objects.filter(user__username="alice").update(digest=None)
+        out = StringIO()
+
+        # ACT
+        call_command("password_history_coverage", stdout=out)
+
+        # ASSERT
+        self.assertEqual(out.getvalue().strip(), "1 of 2 password history entries have no digest (1 users).")
+
+
+class PasswordHistoryPruningTests(BaseTestCase):
+    def create_entries(self, user, count, created=None):
+        for _ in range(count):
+            PasswordHistory.objects.create(user=user, created=created or timezone.now(), password=user.password)
+
+    def test_delete_expired_in_a_single_statement(self):
+        # ARRANGE
+        user = create_user()
+        self.create_entries(user, 5)
+
+        # ACT
+        with self.assertNumQueries(1):
+            deleted = PasswordHistory.objects.delete_expired(user)
+
+        # ASSERT
+        self.assertEqual(deleted, 6 - settings.PASSWORD_ROTATE_HISTORY_COUNT)
+        self.assertEqual(PasswordHistory.objects.count(), settings.PASSWORD_ROTATE_HISTORY_COUNT)
+
+    def test_delete_expired_with_identical_dates(self):
+        """
+        Entries created at the same time should not be deleted together
+        """
+        # ARRANGE
+        user = create_user()
+        PasswordHistory.objects.all().delete()
+        self.create_entries(user, 4, created=timezone.now())
+
+        # ACT
+        PasswordHistory.objects.delete_expired(user, offset=2)
+
+        # ASSERT
+        self.assertEqual(PasswordHistory.objects.count(), 2)
+
+    def test_prune_command(self):
+        # ARRANGE
+        users = [create_user(username=f"user{i}") for i in range(3)]
+        for user in users:
+            self.create_entries(user, 3)
+
+        # ACT
+        call_command("prune_password_history", batch_size=2, history_count=1, stdout=StringIO())
+
+        # ASSERT
+        for user in users:
+            self.assertEqual(user.password_history_entries.count(), 1)
+
+
+class PasswordExpiryReportTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        create_user(username="valid")
+        create_user(username="warning")
+        create_user(username="expired")
+        create_user(username="joined", date_joined=now - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS + 1))
+        PasswordChange.objects.filter(user__username="warning").update(
+            last_changed=now - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS - 60)
+        )
+        PasswordChange.objects.filter(user__username="expired").update(
+            last_changed=now - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS + 1)
+        )
+        PasswordChange.objects.filter(user__username="joined").delete()
+
+    def report(self, *args):
+        out = StringIO()
+        call_command("password_expiry_report", *args, stdout=out)
+        return out.getvalue()
+
+    def test_csv_report(self):
+        lines = self.report().splitlines()
+
+        self.assertEqual(lines[0], "id,username,last_changed,status")
+        statuses = {line.split(",")[1]: line.split(",")[3] for line in lines[1:]}
+        self.assertEqual(
+            statuses, {"valid": "valid", "warning": "warning", "expired": "expired", "joined": "expired"}
+        )
+
+    def test_checkers_built_from_annotations(self):
+        """
+        The checkers of annotated users shouldn't query the database
+        """
+        with self.assertNumQueries(1):
+            users = list(annotate_password_status(get_user_model().objects.all()))
+            checkers = {user.username: PasswordChecker(user) for user in users}
+
+        for user in users:
+            checker = checkers[user.username]
+            self.assertEqual(user.password_expires_at, checker.expiration)
+            self.assertEqual(user.password_status == "expired", checker.is_expired())
+            self.assertEqual(user.password_status in ["warning", "expired"], checker.is_warning())
+
+    @override_settings(PASSWORD_ROTATE_EXCLUDE_SUPERUSERS=True)
+    def test_jsonl_report_filtered_by_status(self):
+        get_user_model().objects.filter(username="joined").update(is_superuser=True)
+
+        rows = [json.loads(line) for line in self.report("--format=jsonl", "--status=expired").splitlines()]
+
+        self.assertEqual([row["username"] for row in rows], ["expired"])
+
+
+class ProvisionUsersTests(BaseTestCase):
+    def bulk_create_users(self, count, date_joined):
+        return get_user_model().objects.bulk_create([
+            get_user_model()(username=f"user{i}", password="!", date_joined=date_joined)
+            for i in range(count)
+        ])
+
+    def test_provision_users(self):
+        # ARRANGE
+        users = self.bulk_create_users(5, timezone.now() - timedelta(days=1))
+
+        # ACT
+        # 2 batches: select the provisioned users, insert PasswordChange and PasswordHistory
+        with self.assertNumQueries(6):
+            provision_users(users, batch_size=3)
+
+        # ASSERT
+        self.assertEqual(PasswordChange.objects.count(), 5)
+        self.assertEqual(PasswordHistory.objects.count(), 5)
+        self.assertFalse(PasswordChecker(users[0]).is_warning())
+
+    @override_settings(
+        PASSWORD_ROTATE_CACHE="default",
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    )
+    def test_provisioned_users_are_skipped(self):
+        # ARRANGE
+        user = create_user()
+        PasswordChange.objects.filter(user=user).update(
+            last_changed=timezone.now() - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS + 1)
+        )
+        cache.clear()
+
+        # ACT
+        provision_users([user])
+
+        # ASSERT
+        self.assertTrue(PasswordChecker(user).is_expired())
+        self.assertEqual(PasswordHistory.objects.filter(user=user).count(), 1)
+
+    def test_backfill_command(self):
+        # ARRANGE
+        date_joined = timezone.now() - timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS + 1)
+        users = self.bulk_create_users(3, date_joined)
+        create_user()
+
+        # ACT
+        call_command("backfill_password_rotate", batch_size=2, stdout=StringIO())
+
+        # ASSERT
+        self.assertEqual(PasswordChange.objects.count(), 4)
+        self.assertEqual(PasswordHistory.objects.count(), 4)
+        # The date the users joined is kept as the date of the last password change
+        self.assertTrue(PasswordChecker(users[0]).is_expired())
+
+
+class ChangePasswordHandlerTests(BaseTestCase):
+    def test_number_of_queries(self):
+        """
+        Changing the password should cost a fixed number of queries:
+        UPDATE user, upsert PasswordChange, insert and prune PasswordHistory (and 1 savepoint)
+        """
+        # ARRANGE
+        user = create_user()
+        user._has_not_previous_password = True
+        user.set_password("some new words")
+
+        # ACT
+        with self.assertNumQueries(6):
+            user.save()
+
+        # ASSERT
+        self.assertEqual(PasswordChange.objects.count(), 1)
+        self.assertEqual(PasswordHistory.objects.filter(user=user).count(), 2)
+
+    def test_missing_password_change_is_created(self):
+        # ARRANGE
+        user = create_user()
+        PasswordChange.objects.all().delete()
+        user.set_password("some new words")
+
+        # ACT
+        with self.assertNumQueries(4):
+            user.save()
+
+        # ASSERT
+        self.assertEqual(PasswordChange.objects.filter(user=user).count(), 1)
+
+
+class PasswordExpiryColumnsTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        now = self.now = timezone.now()
+        for username, age in [("valid", 0), ("warning", settings.PASSWORD_ROTATE_SECONDS - 60),
+                              ("expired", settings.PASSWORD_ROTATE_SECONDS + 60)]:
+            user = create_user(username=username)
+            record = PasswordChange.objects.get(user=user)
+            record.last_changed = now - timedelta(seconds=age)
+            record.save()
+
+    def usernames(self, queryset):
+        return set(queryset.values_list("user__username", flat=True))
+
+    def test_expiry_is_maintained(self):
+        record = PasswordChange.objects.get(user__username="valid")
+
+        self.assertEqual(record.expires_at, record.last_changed + timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS))
+        checker = PasswordChecker(record.user)
+        self.assertEqual((record.expires_at, record.warn_at), (checker.expiration, checker.warning))
+
+        # The upsert of the password change maintains the columns as well
+        record.user.set_password("some new words")
+        record.user.save()
+        record.refresh_from_db()
+        self.assertEqual(record.expires_at, record.last_changed + timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS))
+
+    def test_querysets(self):
+        self.assertEqual(self.usernames(PasswordChange.objects.expired(self.now)), {"expired"})
+        self.assertEqual(self.usernames(PasswordChange.objects.in_warning_window(self.now)), {"warning"})
+        self.assertEqual(
+            self.usernames(PasswordChange.objects.expiring_between(self.now, self.now + timedelta(seconds=120))),
+            {"warning"},
+        )
+
+    def test_recompute_command(self):
+        # ARRANGE
+        with self.settings(PASSWORD_ROTATE_SECONDS=30 * 60):
+            # ACT
+            call_command("recompute_password_expiry", batch_size=2, stdout=StringIO())
+
+            # ASSERT
+            self.assertEqual(self.usernames(PasswordChange.objects.expired(self.now)), set())
+            self.assertEqual(self.usernames(PasswordChange.objects.in_warning_window(self.now)), set())
+
+
+class AdminTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        admin = get_user_model().objects.create_superuser("admin", "admin@example.org", "password")
+        self.client.force_login(admin)
+
+    def get_changelist(self, model, **params):
+        return self.client.get(reverse(f"admin:password_rotate_{model}_changelist"), params)
+
+    def test_changelists_without_n_plus_1_queries(self):
+        for model in ["passwordchange", "passwordhistory"]:
+            with self.subTest(model=model):
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(self.get_changelist(model).status_code, 200)
+                for i in range(3):
+                    create_user(username=f"{model}{i}")
+                with self.assertNumQueries(len(queries)):
+                    self.assertEqual(self.get_changelist(model).status_code, 200)
+
+    def test_passwords_not_listed(self):
+        create_user()
+
+        result_list = self.get_changelist("passwordhistory").context["cl"].result_list
+
+        self.assertEqual(result_list.query.deferred_loading, ({"password", "digest"}, True))
+
+    def test_password_status_filter(self):
+        # ARRANGE
+        user = create_user()
+        PasswordChange.objects.filter(user=user).update(
+            expires_at=timezone.now() - timedelta(seconds=1), warn_at=timezone.now() - timedelta(seconds=2)
+        )
+
+        # ACT
+        expired = self.get_changelist("passwordchange", status="expired").context["cl"].result_list
+        valid = self.get_changelist("passwordchange", status="valid").context["cl"].result_list
+
+        # ASSERT
+        self.assertEqual([record.user for record in expired], [user])
+        self.assertEqual([record.user.username for record in valid], ["admin"])
+
+
+@override_settings(PASSWORD_ROTATE_INSTRUMENTATION="password_rotate.instrumentation.InMemoryCollector")
+class InstrumentationTests(BaseTestCase):
+    def test_events_are_collected(self):
+        # ARRANGE
+        collector = get_collector()
+        create_user()
+        self.client.login(username="bob", password="password")
+
+        # ACT
+        self.client.get("/password_status/")
+        with override_settings(PASSWORD_ROTATE_EXEMPT_URLS=["/some_page/"]):
+            self.client.get("/some_page/")
+        PasswordHistory.objects.check_password(get_user_model().objects.get(), "Hello world")
+
+        # ASSERT
+        self.assertEqual(collector.counters[("middleware", "valid")], 1)
+        self.assertEqual(collector.counters[("middleware", "exempt")], 1)
+        self.assertEqual(collector.counters[("checker", "database")], 2)
+        self.assertEqual(collector.counters[("history_verification", "no_match")], 1)
+        # The login saves the user as well
+        self.assertEqual(collector.counters[("create_user_handler", None)], 2)
+        self.assertEqual(collector.counters[("login_handler", None)], 1)
+        histogram = collector.histograms["history_verification"]
+        self.assertEqual(histogram.count, 1)
+        self.assertEqual(histogram.cumulative_counts()[float("inf")], 1)
+
+    def test_no_collector_by_default(self):
+        with self.settings(PASSWORD_ROTATE_INSTRUMENTATION=None):
+            self.assertIsNone(get_collector())
+
+
+class RotationPolicyTests(BaseTestCase):
+    def test_policy_rebuilt_when_settings_change(self):
+        self.assertEqual(get_policy().allowed_duration, timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS))
+
+        with self.settings(PASSWORD_ROTATE_SECONDS=60, PASSWORD_ROTATE_HISTORY_COUNT=5):
+            self.assertEqual(get_policy().allowed_duration, timedelta(seconds=60))
+            self.assertEqual(PasswordHistory.objects.default_offset, 5)
+
+        self.assertEqual(get_policy().history_count, settings.PASSWORD_ROTATE_HISTORY_COUNT)
+
+    def test_checker_from_policy(self):
+        """
+        A checker can be computed from a policy and a date without any query
+        """
+        # ARRANGE
+        user = create_user()
+        user.is_superuser = True
+        policy = RotationPolicy(seconds=60, warn_seconds=30, history_count=1, exclude_superusers=True)
+        last_changed = timezone.now() - timedelta(seconds=120)
+
+        # ACT
+        with self.assertNumQueries(0):
+            checker = PasswordChecker(user, last_changed=last_changed, policy=policy)
+
+        # ASSERT
+        self.assertEqual(checker.expiration, last_changed + timedelta(seconds=60))
+        self.assertEqual(checker.warning, last_changed + timedelta(seconds=30))
+        self.assertFalse(checker.is_expired())
+        self.assertFalse(hasattr(checker, "__dict__"))
+
+
+class DictionarySimilarityValidatorTests(BaseTestCase):
+    def test_similar_passwords(self):
+        # ARRANGE
+        validator = DictionarySimilarityValidator(
+            words=["Alexandria", "password", "sunshine"], max_similarity_ratio=80
+        )
+
+        # ACT / ASSERT
+        for password in ["alexandria1", "Passw0rd", "SUNSHINE!"]:
+            with self.subTest(password=password), self.assertRaises(ValidationError):
+                validator.validate(password)
+        validator.validate("some new words")
+
+    def test_word_list_file(self):
+        # ARRANGE
+        with tempfile.NamedTemporaryFile("wb", suffix=".txt.gz", delete=False) as f:
+            f.write(gzip.compress(b"alexandria\nrotation\n\n"))
+        self.addCleanup(os.remove, f.name)
+
+        # ACT
+        validator = DictionarySimilarityValidator(word_list_path=f.name)
+
+        # ASSERT
+        self.assertEqual(validator.words, ["alexandria", "rotation"])
+        # The default ratio is PASSWORD_ROTATE_MAX_SIMILARITY_RATIO (50)
+        self.assertEqual(validator.get_similar_word("Rotations 2025"), "rotation")
+        self.assertIsNone(validator.get_similar_word("some new words"))
+
+    def test_missing_words(self):
+        with self.assertRaises(ImproperlyConfigured):
+            DictionarySimilarityValidator()
+
+
+class BreachedPasswordValidatorTests(BaseTestCase):
+    breached = ["123456", "password", "qwerty", "letmein", "Tr0ub4dor&3"]
+
+    def build_file(self, *options, lines=None):
+        if lines is None:
+            lines = sorted(
+                f"{hashlib.sha1(password.encode()).hexdigest().upper()}:{count}"
+                for count, password in enumerate(self.breached, 1)
+            )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        dump = os.path.join(directory, "pwned.txt")
+        with open(dump, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        path = os.path.join(directory, "pwned.bin")
+        call_command("build_breached_password_file", dump, path, *options, stdout=StringIO())
+        return path
+
+    def test_lookup(self):
+        for options in [(), ("--no-index",)]:
+            with self.subTest(options=options):
+                # ARRANGE
+                path = self.build_file(*options)
+
+                # ACT
+                breached_passwords = BreachedPasswordFile(path)
+
+                # ASSERT
+                self.assertEqual(len(breached_passwords), len(self.breached))
+                self.assertEqual(breached_passwords.index is not None, not options)
+                for password in self.breached:
+                    self.assertIn(password, breached_passwords)
+                self.assertNotIn("correct horse battery staple", breached_passwords)
+                self.assertNotIn("123457", breached_passwords)
+
+    def test_validator(self):
+        # ARRANGE
+        validator = BreachedPasswordValidator(path=self.build_file())
+
+        # ACT / ASSERT
+        with self.assertRaises(ValidationError):
+            validator.validate("letmein")
+        validator.validate("correct horse battery staple")
+
+    def test_unsorted_dump(self):
+        # ARRANGE
+        lines = [hashlib.sha1(password.encode()).hexdigest() for password in self.breached]
+
+        # ACT / ASSERT
+        with self.assertRaisesMessage(CommandError, "not sorted"):
+            self.build_file(lines=sorted(lines, reverse=True))
+
+
+class PasswordExpiryNotificationsTests(BaseTestCase):
+    def set_last_changed(self, user, seconds_ago):
+        record = PasswordChange.objects.get(user=user)
+        record.last_changed = timezone.now() - timedelta(seconds=seconds_ago)
+        record.save()
+
+    def test_incremental_notifications(self):
+        # ARRANGE
+        alice = create_user(username="alice")
+        self.set_last_changed(alice, settings.PASSWORD_ROTATE_SECONDS - 150)
+        create_user(username="bob")
+        carol = create_user(username="carol")
+        self.set_last_changed(carol, settings.PASSWORD_ROTATE_SECONDS + 60)
+        dave = create_user(username="dave")
+
+        # ACT
+        call_command("send_password_expiry_notifications", "--url", "https://example.org/", stdout=StringIO())
+        call_command("send_password_expiry_notifications", stdout=StringIO())
+
+        # ASSERT
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["alice@example.org"])
+        self.assertIn("Your password expires in 2 minutes.", mail.outbox[0].body)
+        self.assertIn("https://example.org/", mail.outbox[0].body)
+
+        # ARRANGE
+        # dave enters the warning window after the last run
+        NotificationCheckpoint.objects.update(last_run=timezone.now() - timedelta(seconds=60))
+        self.set_last_changed(dave, settings.PASSWORD_ROTATE_SECONDS - settings.PASSWORD_ROTATE_WARN_SECONDS + 30)
+        mail.outbox = []
+
+        # ACT
+        with self.assertNumQueries(5):
+            call_command("send_password_expiry_notifications", "--batch-size", "1", stdout=StringIO())
+
+        # ASSERT
+        self.assertEqual([message.to for message in mail.outbox], [["dave@example.org"]])
+
+    def test_failed_run_resumes_after_notified_users(self):
+        """
+        A run failing in the middle shouldn't email again the users of the previous batches
+        """
+        # ARRANGE
+        alice = create_user(username="alice")
+        self.set_last_changed(alice, settings.PASSWORD_ROTATE_SECONDS - 120)
+        dave = create_user(username="dave")
+        self.set_last_changed(dave, settings.PASSWORD_ROTATE_SECONDS - 150)
+        send_mass_mail = mock.Mock(wraps=mail.send_mass_mail, side_effect=[1, ConnectionError])
+
+        # ACT
+        with mock.patch(
+            "password_rotate.management.commands.send_password_expiry_notifications.send_mass_mail",
+            send_mass_mail,
+        ), self.assertRaises(ConnectionError):
+            call_command("send_password_expiry_notifications", "--batch-size", "1", stdout=StringIO())
+        call_command("send_password_expiry_notifications", stdout=StringIO())
+
+        # ASSERT
+        self.assertEqual(send_mass_mail.call_args_list[0].args[0][0][3], ["alice@example.org"])
+        self.assertEqual([message.to for message in mail.outbox], [["dave@example.org"]])
+
+
+@override_settings(PASSWORD_ROTATE_POLICIES=[
+    {"name": "admins", "groups": ["Administrators"], "seconds": 60, "warn_seconds": 30, "history_count": 1},
+    {"name": "staff", "attribute": "is_staff", "history_count": 5},
+])
+class GroupPoliciesTests(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.group = Group.objects.create(name="Administrators")
+
+    def get_record(self, user):
+        return PasswordChange.objects.get(user=user)
+
+    def test_policy_stored_when_groups_change(self):
+        # ARRANGE
+        user = create_user()
+        self.assertIsNone(self.get_record(user).policy)
+
+        # ACT / ASSERT
+        user.groups.add(self.group)
+        record = self.get_record(user)
+        self.assertEqual(record.policy, "admins")
+        self.assertEqual(record.expires_at, record.last_changed + timedelta(seconds=60))
+        self.assertEqual(record.warn_at, record.last_changed + timedelta(seconds=30))
+
+        user.groups.remove(self.group)
+        self.assertIsNone(self.get_record(user).policy)
+
+        self.group.user_set.add(user)
+        self.assertEqual(self.get_record(user).policy, "admins")
+
+        self.group.user_set.clear()
+        record = self.get_record(user)
+        self.assertIsNone(record.policy)
+        self.assertEqual(record.expires_at, record.last_changed + timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS))
+
+    def test_checker_without_group_query(self):
+        # ARRANGE
+        user = create_user()
+        user.groups.add(self.group)
+        PasswordChange.objects.filter(user=user).update(last_changed=timezone.now() - timedelta(seconds=61))
+
+        # ACT
+        with self.assertNumQueries(1):
+            checker = PasswordChecker(user)
+
+        # ASSERT
+        self.assertEqual(checker.policy, get_policy("admins"))
+        self.assertTrue(checker.is_expired())
+        self.assertEqual(annotate_password_status(get_user_model().objects.all()).get().password_status, "expired")
+
+    def test_precedence(self):
+        """
+        The first matching policy should apply, then the default policy
+        """
+        # ARRANGE
+        admin = get_user_model()(username="admin", is_staff=True)
+        admin.save()
+        admin.groups.add(self.group)
+        staff = get_user_model().objects.create(username="staff", is_staff=True)
+        user = create_user()
+
+        # ACT / ASSERT
+        self.assertEqual(self.get_record(admin).policy, "admins")
+        self.assertEqual(self.get_record(staff).policy, "staff")
+        self.assertIsNone(self.get_record(user).policy)
+
+    @mock.patch("password_rotate.signals.messages", side_effect=do_nothing())
+    def test_policy_updated_at_login(self, messages):
+        # ARRANGE
+        user = create_user()
+        get_user_model().objects.filter(pk=user.pk).update(is_staff=True)
+
+        # ACT
+        self.client.login(username="bob", password="password")
+
+        # ASSERT
+        self.assertEqual(self.get_record(user).policy, "staff")
+
+    @override_settings(PASSWORD_ROTATE_SESSION_CACHE=True)
+    @mock.patch("password_rotate.signals.messages", side_effect=do_nothing())
+    def test_session_policy_invalidated_when_groups_change(self, messages):
+        """
+        The policy cached in the session should be dropped when the groups of the user change
+        """
+        # ARRANGE
+        cache.clear()
+        user = create_user()
+        PasswordChange.objects.filter(user=user).update(last_changed=timezone.now() - timedelta(seconds=61))
+        self.client.login(username="bob", password="password")
+        self.assertEqual(self.client.get("/password_status/").content, b"valid")
+
+        # ACT
+        user.groups.add(self.group)
+
+        # ASSERT
+        self.assertEqual(self.client.get("/password_status/").status_code, 302)
+        self.assertEqual(self.client.session[SESSION_KEY]["policy"], "admins")
+
+    def test_history_count_of_policy(self):
+        # ARRANGE
+        user = create_user()
+        user.groups.add(self.group)
+        user = get_user_model().objects.get(pk=user.pk)
+
+        # ACT
+        for password in ["Hello world", "Goodbye world"]:
+            user._has_not_previous_password = True
+            user.set_password(password)
+            user.save()
+
+        # ASSERT
+        self.assertEqual(PasswordHistory.objects.filter(user=user).count(), 1)
+        self.assertTrue(PasswordHistory.objects.check_password(user, "Hello world"))
+        self.assertEqual(PasswordHistory.objects.check_passwords([(user, "Hello world")]), [True])
@@ -7,9 +7,14 @@ def some_page(request):
     return HttpResponse("Welcome to some page!")
 
 
+def password_status(request):
+    return HttpResponse(str(request.password_status))
+
+
 urlpatterns = [
     path("", include("django.contrib.auth.urls")),
     path("admin/", admin.site.urls),
     path("password_rotate/", include("password_rotate.urls")),
     path("some_page/", some_page),
+    path("password_status/", password_status),
 ]
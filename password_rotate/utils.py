@@ -1,10 +1,25 @@
-from datetime import timedelta
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
 
 from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY
+from django.db.models import (
+    Case, CharField, DateTimeField, DurationField, ExpressionWrapper, F, Value, When, prefetch_related_objects
+)
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 import humanize
 
-from .models import PasswordChange
+from . import cache
+from .instrumentation import instrument
+from .models import PasswordChange, PasswordHistory
+from .policy import get_policies, get_policy, resolve_policy
+from .routing import aget_read_database, get_read_database
+
+
+# Key of the password status cached in the session
+SESSION_KEY = "_password_rotate"
 
 
 def request_is_ajax(request):
@@ -12,20 +27,267 @@ def request_is_ajax(request):
     return request.META.get("HTTP_X_REQUESTED_WITH") == "XMLHttpRequest"
 
 
+def session_cache_enabled():
+    return getattr(settings, "PASSWORD_ROTATE_SESSION_CACHE", False)
+
+
+def cache_password_status(request, checker, policy_version=None):
+    """
+    Stores the date of the last password change and the name of the policy of
+    the user in the session so that the
+    expiration and the warning can be computed without querying the database.
+
+    The entry is bound to the session auth hash and to the version of the user's
+    policy (see `cache.get_policy_version`): it is ignored as soon as the password
+    or the groups of the user change.
+    """
+    request.session[SESSION_KEY] = {
+        "last_changed": checker.last_changed.isoformat(),
+        "policy": checker.policy.name,
+        "policy_version": policy_version,
+        "hash": request.session.get(HASH_SESSION_KEY),
+    }
+
+
+def is_password_status_valid(request, cached, policy_version):
+    return (
+        cached is not None
+        and cached.get("hash") == request.session.get(HASH_SESSION_KEY)
+        and cached.get("policy_version") == policy_version
+    )
+
+
+def clear_password_status(request):
+    request.session.pop(SESSION_KEY, None)
+
+
+def get_password_checker(request):
+    """
+    Returns a `PasswordChecker` for the user of the request.
+
+    When `PASSWORD_ROTATE_SESSION_CACHE` is enabled, the checker is built from
+    the session and the database is only queried when the session has no
+    valid entry.
+    """
+    if not session_cache_enabled():
+        return PasswordChecker(request.user, using=get_read_database(PasswordChange, request.user))
+
+    policy_version = cache.get_policy_version(request.user.pk)
+    cached = request.session.get(SESSION_KEY)
+    if is_password_status_valid(request, cached, policy_version):
+        last_changed = datetime.fromisoformat(cached["last_changed"])
+        return PasswordChecker(request.user, last_changed=last_changed, policy=get_policy(cached.get("policy")))
+
+    checker = PasswordChecker(request.user, using=get_read_database(PasswordChange, request.user))
+    cache_password_status(request, checker, policy_version)
+    return checker
+
+
+async def aget_user(request):
+    """
+    Returns the user of the request without blocking the event loop.
+    """
+    if hasattr(request, "auser"):
+        return await request.auser()
+
+    # Django < 5.0
+    def get_user():
+        # evaluates the lazy object
+        request.user.is_authenticated
+        return request.user
+    return await sync_to_async(get_user)()
+
+
+async def aget_password_checker(request, user):
+    """
+    Async version of `get_password_checker`.
+
+    The session has already been loaded by the authentication.
+    """
+    if not session_cache_enabled():
+        return await PasswordChecker.acreate(user, using=await aget_read_database(PasswordChange, user))
+
+    policy_version = await cache.aget_policy_version(user.pk)
+    cached = request.session.get(SESSION_KEY)
+    if is_password_status_valid(request, cached, policy_version):
+        last_changed = datetime.fromisoformat(cached["last_changed"])
+        return PasswordChecker(user, last_changed=last_changed, policy=get_policy(cached.get("policy")))
+
+    checker = await PasswordChecker.acreate(user, using=await aget_read_database(PasswordChange, user))
+    cache_password_status(request, checker, policy_version)
+    return checker
+
+
+def annotate_password_status(queryset, now=None):
+    """
+    Annotates a queryset of users with the date of their last password change
+    (`password_last_changed`, defaulting to `date_joined`), the name of their
+    policy (`password_policy`), the expiration (`password_expires_at`) and
+    the status of their password (`password_status`): "valid", "warning",
+    "expired" or "excluded".
+
+    The status is computed by the database, with a single query. A `PasswordChecker`
+    of an annotated user doesn't query the database.
+    """
+    if now is None:
+        now = timezone.now()
+    policy = get_policy()
+
+    whens = []
+    if policy.exclude_superusers:
+        whens.append(When(is_superuser=True, then=Value("excluded")))
+    whens += [
+        When(password_expires_at__lt=now, then=Value("expired")),
+        When(password_warn_at__lt=now, then=Value("warning")),
+    ]
+    return queryset.annotate(
+        password_last_changed=Coalesce("passwordchange__last_changed", "date_joined"),
+        password_policy=F("passwordchange__policy"),
+    ).annotate(
+        password_expires_at=ExpressionWrapper(
+            F("password_last_changed") + get_policy_duration(lambda policy: policy.allowed_duration),
+            output_field=DateTimeField(),
+        ),
+        password_warn_at=ExpressionWrapper(
+            F("password_last_changed") + get_policy_duration(
+                lambda policy: policy.allowed_duration - policy.warning_duration
+            ),
+            output_field=DateTimeField(),
+        ),
+    ).annotate(
+        password_status=Case(*whens, default=Value("valid"), output_field=CharField()),
+    )
+
+
+def get_policy_duration(duration):
+    """
+    Returns an expression of the `duration(policy)` of the policy of each user.
+    """
+    whens = [
+        When(passwordchange__policy=policy.name, then=Value(duration(policy)))
+        for policy in get_policies() if policy.name is not None
+    ]
+    default = Value(duration(get_policy()), output_field=DurationField())
+    if not whens:
+        return default
+    return Case(*whens, default=default, output_field=DurationField())
+
+
+class PasswordStatusQuerySetMixin:
+    """
+    Adds `with_password_status()` to a queryset of users::
+
+        class UserQuerySet(PasswordStatusQuerySetMixin, models.QuerySet):
+            pass
+
+        class User(AbstractUser):
+            objects = UserManager.from_queryset(UserQuerySet)()
+    """
+    def with_password_status(self, now=None):
+        return annotate_password_status(self, now)
+
+
+def provision_users(users, batch_size=1000, use_date_joined=False):
+    """
+    Creates the `PasswordChange` and the initial `PasswordHistory` entry of users
+    created without the `post_save` signal (with `bulk_create` for example).
+    The users who already have a `PasswordChange` are skipped.
+
+    :arg users: A list of :class:`~django.contrib.auth.models.User` instances.
+    :arg int batch_size: The number of users processed by each batch of queries.
+    :arg bool use_date_joined: Use the date the users joined as the date of the
+          last password change instead of now.
+    """
+    now = timezone.now()
+    for start in range(0, len(users), batch_size):
+        # Each query has at most `batch_size` parameters
+        batch = users[start:start + batch_size]
+        provisioned = set(
+            PasswordChange.objects.filter(user__in=[user.pk for user in batch]).values_list("user_id", flat=True)
+        )
+        batch = [user for user in batch if user.pk not in provisioned]
+        if not batch:
+            continue
+        if len(get_policies()) > 1:
+            # The policies matching the groups are resolved without a query per user
+            prefetch_related_objects(batch, "groups")
+        changes = []
+        entries = []
+        for user in batch:
+            last_changed = user.date_joined if use_date_joined else now
+            change = PasswordChange(user=user, last_changed=last_changed, policy=resolve_policy(user).name)
+            change.set_expiry()
+            changes.append(change)
+            entries.append(PasswordHistory(user=user, created=last_changed, password=user.password))
+        PasswordChange.objects.bulk_create(changes, ignore_conflicts=True)
+        PasswordHistory.objects.bulk_create(entries)
+        cache.set_many_password_changes({change.user_id: (change.last_changed, change.policy) for change in changes})
+
+
+def get_password_status(request, checker):
+    """
+    Returns "expired" when the password of the authenticated user expired,
+    "valid" otherwise.
+    """
+    if request.user.is_authenticated and checker.is_expired():
+        return "expired"
+    return "valid"
+
+
 class PasswordChecker:
     """
     Checks if password has expired or if it will expire soon
+
+    The checker is a lightweight value computed from the rotation policy and
+    the date of the last password change.
     """
-    def __init__(self, user):
-        # password expires: last_changed + password_duration
-        self.password_allowed_duration = timedelta(seconds=settings.PASSWORD_ROTATE_SECONDS)
-        # start warning at password expiration - duration
-        self.password_warning_duration = timedelta(seconds=settings.PASSWORD_ROTATE_WARN_SECONDS)
+    __slots__ = ("user", "policy", "last_changed", "expiration", "warning")
 
+    def __init__(self, user, last_changed=None, policy=None, using=None):
         self.user = user
-        self.last_changed = self.get_last_changed()
-        self.expiration = self.last_changed + self.password_allowed_duration
-        self.warning = self.expiration - self.password_warning_duration
+        if last_changed is None:
+            # the user may have been annotated by `annotate_password_status`
+            last_changed = getattr(user, "password_last_changed", None)
+            if last_changed is not None and policy is None:
+                policy = get_policy(getattr(user, "password_policy", None))
+        if last_changed is None:
+            last_changed, policy_name = self.get_password_change(using)
+            if policy is None:
+                policy = get_policy(policy_name)
+        self.policy = policy or get_policy()
+        self.last_changed = last_changed
+        self.expiration = self.policy.get_expiration(last_changed)
+        self.warning = self.policy.get_warning(last_changed)
+
+    @property
+    def password_allowed_duration(self):
+        return self.policy.allowed_duration
+
+    @property
+    def password_warning_duration(self):
+        return self.policy.warning_duration
+
+    @classmethod
+    async def acreate(cls, user, using=None):
+        """
+        Async version of `PasswordChecker(user)` which uses the async ORM.
+        """
+        with instrument("checker") as measure:
+            password_change = await cache.aget_password_change(user.pk)
+            measure.outcome = "cache"
+            if password_change is None:
+                # if no record, fallback to when user created
+                try:
+                    password_change = await (
+                        PasswordChange.objects.using(using).values_list("last_changed", "policy").aget(user=user)
+                    )
+                    measure.outcome = "database"
+                except PasswordChange.DoesNotExist:
+                    password_change = (user.date_joined, None)
+                    measure.outcome = "date_joined"
+                await cache.aadd_password_change(user.pk, *password_change)
+        last_changed, policy = password_change
+        return cls(user, last_changed=last_changed, policy=get_policy(policy))
 
     def is_expired(self):
         if self.is_user_excluded():
@@ -48,18 +310,31 @@ class PasswordChecker:
         else:
             return None
 
-    def get_last_changed(self):
-        # if no record, fallback to when user created
-        try:
-            record = PasswordChange.objects.get(user=self.user)
-            last_changed = record.last_changed
-        except PasswordChange.DoesNotExist:
-            last_changed = self.user.date_joined
-        return last_changed
+    def get_password_change(self, using=None):
+        """
+        Returns the date of the last password change and the name of the policy
+        of the user.
+        """
+        with instrument("checker") as measure:
+            password_change = cache.get_password_change(self.user.pk)
+            if password_change is not None:
+                measure.outcome = "cache"
+                return password_change
+
+            # if no record, fallback to when user created
+            try:
+                password_change = (
+                    PasswordChange.objects.using(using).values_list("last_changed", "policy").get(user=self.user)
+                )
+                measure.outcome = "database"
+            except PasswordChange.DoesNotExist:
+                password_change = (self.user.date_joined, None)
+                measure.outcome = "date_joined"
+            cache.add_password_change(self.user.pk, *password_change)
+            return password_change
+
+    def get_last_changed(self, using=None):
+        return self.get_password_change(using)[0]
 
     def is_user_excluded(self):
-        # admin can configure so superusers are excluded from check
-        if hasattr(settings, "PASSWORD_ROTATE_EXCLUDE_SUPERUSERS") and\
-                settings.PASSWORD_ROTATE_EXCLUDE_SUPERUSERS:
-            return self.user.is_superuser
-        return False
+        return self.policy.is_user_excluded(self.user)
@@ -1,6 +1,11 @@
+import gzip
+
+from django.conf import settings
 from django.utils.translation import gettext_lazy as _
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from rapidfuzz import fuzz, process, utils
 
+from password_rotate.breached import BreachedPasswordFile
 from password_rotate.models import PasswordHistory
 
 
@@ -25,3 +30,109 @@ class NotPreviousPasswordValidator:
 
     def get_help_text(self):
         return _("Your password must be different from any previous one.")
+
+
+class BreachedPasswordValidator:
+    """
+    Validate that the password doesn't appear in a list of breached passwords.
+
+    The list is a local file built by the `build_breached_password_file` command,
+    given with the `path` option or the `PASSWORD_ROTATE_BREACHED_PASSWORDS_FILE`
+    setting. It is memory-mapped once and searched without loading it.
+    """
+    _files = {}
+
+    def __init__(self, path=None):
+        path = path or getattr(settings, "PASSWORD_ROTATE_BREACHED_PASSWORDS_FILE", None)
+        if not path:
+            raise ImproperlyConfigured(
+                "BreachedPasswordValidator requires the path option or PASSWORD_ROTATE_BREACHED_PASSWORDS_FILE."
+            )
+        self.path = str(path)
+
+    @property
+    def breached_passwords(self):
+        if self.path not in self._files:
+            self._files[self.path] = BreachedPasswordFile(self.path)
+        return self._files[self.path]
+
+    def validate(self, password, user=None):
+        if password in self.breached_passwords:
+            raise ValidationError(
+                _("This password has appeared in a data breach."),
+                code="password_breached",
+            )
+
+    def get_help_text(self):
+        return _("Your password can't be a password that has appeared in a data breach.")
+
+
+class DictionarySimilarityValidator:
+    """
+    Validate that the password is not too similar to a word of a list (company
+    words, product names, common base words...).
+
+    The words are given with the `words` option or loaded from the file
+    `word_list_path` (one word per line, optionally gzipped). They are loaded and
+    preprocessed once. The password is scored against all of them by rapidfuzz
+    and rejected when the similarity ratio reaches `max_similarity_ratio`
+    (defaults to `PASSWORD_ROTATE_MAX_SIMILARITY_RATIO`).
+    """
+    _word_lists = {}
+
+    def __init__(self, words=None, word_list_path=None, max_similarity_ratio=None):
+        if not words and not word_list_path:
+            raise ImproperlyConfigured(
+                "DictionarySimilarityValidator requires the words or the word_list_path option."
+            )
+        if max_similarity_ratio is None:
+            max_similarity_ratio = settings.PASSWORD_ROTATE_MAX_SIMILARITY_RATIO
+        self.max_similarity_ratio = max_similarity_ratio
+        choices = list(words or [])
+        if word_list_path:
+            choices += self.load_word_list(word_list_path)
+        self.words = self.preprocess(choices)
+
+    @classmethod
+    def load_word_list(cls, path):
+        path = str(path)
+        if path not in cls._word_lists:
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                with open(path, encoding="utf-8") as f:
+                    lines = f.read().splitlines()
+            cls._word_lists[path] = lines
+        return cls._word_lists[path]
+
+    @staticmethod
+    def preprocess(words):
+        return list(dict.fromkeys(
+            processed for processed in map(utils.default_process, words) if processed
+        ))
+
+    def get_similar_word(self, password):
+        """
+        Returns the most similar word if it is too similar to the password, None otherwise.
+        """
+        if not self.words:
+            return None
+        match = process.extractOne(
+            utils.default_process(password),
+            self.words,
+            scorer=fuzz.ratio,
+            processor=None,
+            score_cutoff=self.max_similarity_ratio,
+        )
+        return match[0] if match else None
+
+    def validate(self, password, user=None):
+        if self.get_similar_word(password) is not None:
+            raise ValidationError(
+                _("The password is too similar to a common word."),
+                code="password_too_similar_to_word",
+            )
+
+    def get_help_text(self):
+        return _("Your password can't be too similar to a common word.")
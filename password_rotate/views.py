@@ -2,6 +2,7 @@ from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.views import PasswordChangeView
 
 from password_rotate.forms import ForcePasswordChangeForm
+from password_rotate.utils import clear_password_status
 
 
 class ForcePasswordChangeView(PasswordChangeView):
@@ -18,5 +19,7 @@ class ForcePasswordChangeView(PasswordChangeView):
         # Updating the password logs out all other sessions for the user
         # except the current one.
         update_session_auth_hash(self.request, form.user)
+        # The password status cached in the session is now outdated
+        clear_password_status(self.request)
         self.request.password_status = "valid"
         return super().form_valid(form)